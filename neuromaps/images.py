@@ -172,7 +172,7 @@ def load_gifti(img):
     return img
 
 
-def load_data(data):
+def load_data(data, dtype=None):
     """
     Load and stack `data` images (gifti / nifti) into numpy arrays.
 
@@ -186,6 +186,10 @@ def load_data(data):
         (array-like), it is converted to an array and returned as-is.
         Images stored in a tuple will be loaded into numpy arrays, then
         stacked.
+    dtype : {'float32', 'float64'}, optional
+        Floating point type of loaded data. If not specified volumetric images
+        are loaded as float64 and all other data retain their stored type.
+        Default: None
 
     Returns
     -------
@@ -216,8 +220,9 @@ def load_data(data):
                 and "Nifti1Image" in str(err)
                 )
            ):
-            out = np.stack([load_nifti(img).get_fdata() for img in data],
-                           axis=3)
+            fdtype = np.float64 if dtype is None else dtype
+            out = np.stack([load_nifti(img).get_fdata(dtype=fdtype)
+                            for img in data], axis=3)
         # array_like (parcellated)
         else:
             data = np.asarray(data)
@@ -226,6 +231,9 @@ def load_data(data):
             else:
                 raise err
 
+    if dtype is not None:
+        out = out.astype(dtype, copy=False)
+
     return np.squeeze(out)
 
 
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 """Implementation of surrogate map generation as in Burt et al., 2018, Nat Neuro."""
 
+from functools import partial
 import warnings
 
 import numpy as np
+from scipy.linalg import lu_factor, lu_solve
 from scipy.optimize import least_squares
 from scipy import sparse as ssp
+from scipy.sparse.linalg import splu
 from scipy.stats import boxcox
 
+# upper bound on the size of the right-hand sides solved for at once
+_MAX_CHUNK_BYTES = 2 ** 27
+
 
 def _make_weight_matrix(x, d0):
     """
@@ -15,16 +21,28 @@ def _make_weight_matrix(x, d0):
 
     Parameters
     ----------
-    x : array_like
-        Distance matrix
+    x : array_like or scipy.sparse matrix
+        Distance matrix. If sparse, only the stored (off-diagonal) entries are
+        considered to be neighbours and the weight matrix is also sparse
     d0 : float
         Estimate of spatial scale of autocorrelation
 
     Returns
     -------
-    W : numpy.ndarray
+    W : numpy.ndarray or scipy.sparse.csr_matrix
         Weight matrix
     """
+    if ssp.issparse(x):
+        x = ssp.coo_matrix(x)
+        keep = x.row != x.col
+        with np.errstate(over='ignore'):
+            weight = ssp.csr_matrix((np.exp(-x.data[keep] / d0),
+                                     (x.row[keep], x.col[keep])),
+                                    shape=x.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            norm = 1 / np.asarray(weight.sum(axis=1)).ravel()
+        return weight @ ssp.diags(norm)
+
     with np.errstate(over='ignore'):
         weight = np.exp(-x / d0) * np.logical_not(np.eye(len(x), dtype=bool))
 
@@ -32,14 +50,77 @@ def _make_weight_matrix(x, d0):
         return weight / np.sum(weight, axis=1)
 
 
-def estimate_rho_d0(x, y, rho=None, d0=None):
+class _WeightKernel:
     """
-    Use a least-squares fit to estimate `rho` and `d0`.
+    Spatial weights and their derivative with respect to `d0`.
+
+    The exponential kernel for the most recent `d0` is cached so that the
+    residuals and Jacobian evaluated at the same parameters (as is done by
+    :func:`scipy.optimize.least_squares`) share a single kernel.
 
     Parameters
     ----------
-    x : array_like
+    x : array_like or scipy.sparse matrix
         Distance matrix
+    """
+
+    def __init__(self, x):
+        if ssp.issparse(x):
+            x = ssp.coo_matrix(x)
+            keep = x.row != x.col
+            x = ssp.csr_matrix((x.data[keep], (x.row[keep], x.col[keep])),
+                               shape=x.shape)
+        else:
+            x = np.asarray(x, dtype='float64')
+        self.x = x
+        self.d0, self.kernel, self.norm = None, None, None
+
+    def __call__(self, d0):
+        """Return unnormalized weights and their row sums for `d0`."""
+        if d0 != self.d0:
+            with np.errstate(over='ignore'):
+                if ssp.issparse(self.x):
+                    kernel = self.x.copy()
+                    kernel.data = np.exp(-kernel.data / d0)
+                else:
+                    kernel = np.exp(-self.x / d0)
+                    np.fill_diagonal(kernel, 0)
+            norm = np.asarray(kernel.sum(axis=1)).ravel()
+            self.d0, self.kernel, self.norm = d0, kernel, norm
+        return self.kernel, self.norm
+
+    def weighted(self, y, d0):
+        """Return ``W @ y`` for `d0` (see :func:`_make_weight_matrix`)."""
+        kernel, norm = self(d0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return kernel @ (y / norm)
+
+    def gradient(self, y, d0):
+        """Return derivative of ``W @ y`` with respect to `d0`."""
+        kernel, norm = self(d0)
+        # dW_ij / dd0 = W_ij * (x_ij - m_j) / d0 ** 2, where m_j is the
+        # kernel-weighted mean distance of row j
+        if ssp.issparse(kernel):
+            dist = kernel.copy()
+            dist.data = kernel.data * self.x.data
+        else:
+            with np.errstate(invalid='ignore'):
+                dist = np.where(kernel > 0, kernel * self.x, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ynorm = y / norm
+            mean = np.asarray(dist.sum(axis=1)).ravel() / norm
+            return (dist @ ynorm - kernel @ (mean * ynorm)) / d0 ** 2
+
+
+def estimate_rho_d0(x, y, rho=None, d0=None, n_sample=None, seed=None):
+    """
+    Use a least-squares fit to estimate `rho` and `d0`.
+
+    Parameters
+    ----------
+    x : array_like or scipy.sparse matrix
+        Distance matrix. If sparse, only distances between neighbours are
+        stored (see :func:`neuromaps.points.sparsify_distance`)
     y : array_like
         Dependent brain-imaging variable; all values must be positive in order
         for successful Box-Cox transformation
@@ -48,6 +129,14 @@ def estimate_rho_d0(x, y, rho=None, d0=None):
     d0 : float, optional
         Initial guess for d0 (spatial scale of autocorrelation) parameter.
         Default: 1.0
+    n_sample : int, optional
+        If specified, fit the model on a random subset of `n_sample`
+        observations (i.e., on the matching rows and columns of `x`) instead
+        of on all observations. This approximates the full fit at a fraction
+        of the cost. Default: None
+    seed : {int, np.random.Generator instance, None}, optional
+        Seed for selecting the random subset of observations. Only used if
+        `n_sample` is specified. Default: None
 
     Returns
     -------
@@ -57,10 +146,14 @@ def estimate_rho_d0(x, y, rho=None, d0=None):
         Estimate of `d0` based on least-squares fit between `x` and `y`
     """
 
-    def _estimate(parameters, x, y):
+    def _estimate(parameters, kernel, y):
         rho, d0 = parameters
-        y_hat = rho * (_make_weight_matrix(x, d0) @ y)
-        return y - y_hat
+        return y - rho * kernel.weighted(y, d0)
+
+    def _jacobian(parameters, kernel, y):
+        rho, d0 = parameters
+        return np.column_stack([-kernel.weighted(y, d0),
+                                -rho * kernel.gradient(y, d0)])
 
     if rho is None:
         rho = 1.0
@@ -68,9 +161,16 @@ def estimate_rho_d0(x, y, rho=None, d0=None):
         d0 = 1.0
 
     y, *_ = boxcox(y)
+    if n_sample is not None and n_sample < len(y):
+        rs = np.random.default_rng(seed)
+        idx = np.sort(rs.choice(len(y), size=n_sample, replace=False))
+        x = x[idx][:, idx] if ssp.issparse(x) else x[np.ix_(idx, idx)]
+        y = y[idx]
     y -= y.mean()
 
-    return least_squares(_estimate, [rho, d0], args=(x, y), method='lm').x
+    kernel = _WeightKernel(x)
+    return least_squares(_estimate, [rho, d0], jac=_jacobian,
+                         args=(kernel, y), method='lm').x
 
 
 def make_surrogate(x, y, rho=None, d0=None, seed=None, return_order=False,
@@ -80,8 +180,9 @@ def make_surrogate(x, y, rho=None, d0=None, seed=None, return_order=False,
 
     Parameters
     ----------
-    x : array_like
-        Distance matrix
+    x : array_like or scipy.sparse matrix
+        Distance matrix. If sparse, only distances between neighbours are
+        stored (see :func:`neuromaps.points.sparsify_distance`)
     y : array_like
         Dependent brain-imaging variable; all values must be positive
     rho : float, optional
@@ -108,9 +209,12 @@ def make_surrogate(x, y, rho=None, d0=None, seed=None, return_order=False,
         rho, d0 = estimate_rho_d0(x, y, rho=rho, d0=d0)
 
     w = _make_weight_matrix(x, d0)
-    u = rs.standard_normal(len(x))
-    i = np.identity(len(x))
-    surr = np.linalg.solve(i - rho * w, u)
+    u = rs.standard_normal(x.shape[0])
+    if ssp.issparse(w):
+        iw = ssp.csc_matrix(ssp.identity(x.shape[0]) - rho * w)
+        surr = splu(iw).solve(u)
+    else:
+        surr = np.linalg.solve(np.identity(len(x)) - rho * w, u)
 
     order = surr.argsort()
     surr[order] = np.sort(y)
@@ -126,22 +230,38 @@ def make_surrogate(x, y, rho=None, d0=None, seed=None, return_order=False,
 
 
 def batch_surrogates(x, y, rho=None, d0=None, seed=None, n_surr=1000,
-                     n_jobs=1):
+                     n_jobs=1, chunk_size=None, n_sample=None):
     """
     Generate `n_surr` surrogates maps of `y` using Burt-2018 method.
 
+    The matrix defining the spatial autoregressive model is factorized once
+    (LU decomposition, or sparse LU if the matrix is mostly zeros) and all
+    surrogates are obtained by solving for many right-hand sides at once.
+
     Parameters
     ----------
-    x : (N, N) array_like
-        Distance matrix
+    x : (N, N) array_like or scipy.sparse matrix
+        Distance matrix. If sparse, only distances between neighbours are
+        stored (see :func:`neuromaps.points.sparsify_distance`) and the model
+        is solved without ever constructing a dense (N, N) matrix
     y : (N,) array_like
         Dependent brain-imaging variable; all values must be positive
     n_surr : int, optional
         Number of surrogates maps to generate. Default: 1000
     n_jobs : int, optional
-        Number of processes to use while generating surrogate maps. Default: 1
+        Number of processes to use while generating surrogate maps. Each
+        process factorizes the model matrix once. Default: 1
     seed : {int, None}, optional
         Random seed for generating surrogates. Default: None
+    chunk_size : int, optional
+        Number of surrogate maps solved for at once, which bounds the memory
+        used by the right-hand sides of each solve. Results do not depend on
+        `chunk_size`. If not specified surrogates are split evenly across
+        `n_jobs` chunks of at most 128 MiB each. Default: None
+    n_sample : int, optional
+        Number of randomly selected observations used to estimate `rho` and
+        `d0` if they are not provided (see :func:`estimate_rho_d0`). Default:
+        None (use all observations)
 
     Returns
     -------
@@ -149,7 +269,7 @@ def batch_surrogates(x, y, rho=None, d0=None, seed=None, n_surr=1000,
         Generated surrogate maps
     """
     try:
-        from joblib import Parallel, delayed
+        from joblib import Parallel, delayed, effective_n_jobs
         joblib_avail = True
     except ImportError:
         if n_jobs != 1:
@@ -157,34 +277,59 @@ def batch_surrogates(x, y, rho=None, d0=None, seed=None, n_surr=1000,
                           stacklevel=2)
         joblib_avail = False
 
-    def _quick_surr(iw, ysort, seed=None):
-        rs = np.random.default_rng(seed)
-        u = rs.standard_normal(iw.shape[0])
+    def _quick_surr(iw, ysort, chunks):
+        # factorize once and reuse the factorization for every chunk
         if ssp.issparse(iw):
-            surr = ssp.linalg.spsolve(iw, u)
+            solve = splu(iw).solve
         else:
-            surr = np.linalg.solve(iw, u)
-        surr[surr.argsort()] = ysort
-
-        return surr
+            solve = partial(lu_solve, lu_factor(iw))
+        surrs = []
+        for chunk in chunks:
+            # every surrogate keeps its own seed so results don't depend on
+            # `chunk_size` or `n_jobs`
+            u = np.column_stack([
+                np.random.default_rng(seed).standard_normal(len(ysort))
+                for seed in chunk
+            ])
+            surr = solve(u)
+            np.put_along_axis(surr, surr.argsort(axis=0), ysort[:, None],
+                              axis=0)
+            surrs.append(surr)
+
+        return np.column_stack(surrs)
 
     rs = np.random.default_rng(seed)
     seeds = rs.integers(np.iinfo(np.int32).max, size=n_surr)
 
     if rho is None or d0 is None:
-        rho, d0 = estimate_rho_d0(x, y)
-    iw = np.identity(len(x)) - rho * _make_weight_matrix(x, d0)
-    zeros = np.isclose(iw, 0)
-    if (zeros.sum() / iw.size) > 0.5:
-        iw[np.isclose(iw, 0)] = 0
-        iw = ssp.csr_matrix(iw)
+        rho, d0 = estimate_rho_d0(x, y, n_sample=n_sample, seed=seed)
+    if ssp.issparse(x):
+        iw = ssp.csc_matrix(ssp.identity(x.shape[0])
+                            - rho * _make_weight_matrix(x, d0))
+    else:
+        iw = np.identity(len(x)) - rho * _make_weight_matrix(x, d0)
+        zeros = np.isclose(iw, 0)
+        if (zeros.sum() / iw.size) > 0.5:
+            iw[np.isclose(iw, 0)] = 0
+            iw = ssp.csc_matrix(iw)
     ysort = np.sort(y)
 
-    if joblib_avail:
+    n_jobs = effective_n_jobs(n_jobs) if joblib_avail else 1
+    if chunk_size is None:
+        chunk_size = min(int(np.ceil(n_surr / n_jobs)),
+                         max(1, _MAX_CHUNK_BYTES // (8 * len(ysort))))
+    chunks = [seeds[n:n + chunk_size]
+              for n in range(0, n_surr, max(chunk_size, 1))]
+
+    # each process factorizes `iw` once and solves a contiguous share of the
+    # chunks (factorizations cannot always be pickled)
+    if n_jobs > 1:
+        bounds = np.linspace(0, len(chunks), n_jobs + 1).astype(int)
         surrs = Parallel(n_jobs=n_jobs)(
-            delayed(_quick_surr)(iw, ysort, seed=seed) for seed in seeds
+            delayed(_quick_surr)(iw, ysort, chunks[lo:hi])
+            for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
         )
     else:
-        surrs = [_quick_surr(iw, ysort, seed=seed) for seed in seeds]
+        surrs = [_quick_surr(iw, ysort, chunks)]
 
     return np.column_stack(surrs)
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 """Functionality for running spatial null models."""
 
+import hashlib
+import json
 import os
+from pathlib import Path
+import shutil
 import tempfile
+from joblib import Parallel, delayed, effective_n_jobs, parallel_backend
 import nibabel as nib
 import numpy as np
-from scipy import ndimage
+from scipy import sparse
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from packaging import version
 try:
@@ -22,13 +28,21 @@ except ImportError:
 
 from neuromaps.datasets import fetch_atlas
 from neuromaps.datasets.atlases import _sanitize_atlas
-from neuromaps.images import load_data, load_nifti, PARCIGNORE
-from neuromaps.points import get_surface_distance
+from neuromaps.datasets.utils import get_data_dir
+from neuromaps.images import load_data, load_gifti, load_nifti, PARCIGNORE
+from neuromaps.points import (CondensedDistance, get_surface_distance,
+                              sparsify_distance)
 from neuromaps.transforms import mni152_to_mni152
 from neuromaps.nulls.burt import batch_surrogates
 from neuromaps.nulls.spins import (gen_spinsamples, get_parcel_centroids,
                                    load_spins, spin_data, spin_parcels)
+from neuromaps.utils import _split_n_proc
 HEMI = dict(left='L', lh='L', right='R', rh='R')
+# default upper bound on the size of the distance matrix cache (in bytes)
+_DISTMAT_CACHE_SIZE = 2 ** 34
+# version of cached distance matrices; must be incremented whenever the way
+# distance matrices are computed changes, so stale matrices are not reused
+_DISTMAT_CACHE_VERSION = 1
 
 
 _nulls_input_docs = dict(
@@ -104,18 +118,62 @@ n_proc : int, optional
     Number of processors to use for parallelizing computations. If negative
     will use max available processors plus 1 minus the specified number.
     Default: 1 (no parallelization)\
+""",
+    n_proc_spins="""\
+n_proc : int, optional
+    Number of processes across which rotations are distributed if `batch` is
+    True, otherwise number of threads used to match rotated coordinates. If
+    negative will use max available processors plus 1 minus the specified
+    number. Default: 1 (no parallelization)
+batch : bool, optional
+    Whether to draw every rotation from its own seed derived from `seed` and
+    generate rotations in batches across `n_proc` processes, such that
+    results do not depend on `n_proc`. Rotations then differ from (but are
+    equally random as) those generated one at a time with the same `seed`.
+    See :func:`neuromaps.nulls.spins.gen_spinsamples`. Default: False\
+""",
+    n_proc_surrogates="""\
+n_proc : int, optional
+    Number of processors to use for parallelizing computations. If negative
+    will use max available processors plus 1 minus the specified number. For
+    surface data with `n_proc` > 1 both hemispheres are processed concurrently
+    in separate processes and each uses half of the processors; the BLAS /
+    OpenMP threads of all workers are limited such that no more than `n_proc`
+    processors are used in total. Results do not depend on `n_proc` when
+    `seed` is an integer. Default: 1 (no parallelization)\
 """,
     distmat="""\
 distmat : tuple-of-str or os.PathLike, optional
     Filepaths to pre-computed (left, right) surface distance matrices.
     Providing this will cause `atlas`, `density`, and `parcellation` to be
-    ignored. Default: None\
+    ignored. If not specified surface distance matrices are computed once and
+    cached in the neuromaps data directory, from which they are reused by
+    subsequent calls (see Notes of :func:`neuromaps.nulls.burt2018`).
+    Distance matrices may also be provided as
+    :class:`neuromaps.points.CondensedDistance`, including a single such
+    matrix for volumetric data without `parcellation`. Default: None\
 """,
     tempdir="""\
 tempdir: os.PathLike, optional
     Directory specifying where the temporary distance matrix computed when
     generating volumetric nulls without parcellations should be stored. If
     None, a default directory is used. Default: None\
+""",
+    dtype="""\
+dtype : {'float64', 'float32'}, optional
+    Floating point type of the generated null maps. Using 'float32' halves the
+    memory required to store them. Default: 'float64'\
+""",
+    sparse="""\
+n_neighbors : int, optional
+    If specified, the spatial weight matrix only includes the `n_neighbors`
+    nearest neighbours of every vertex / voxel and is stored as a sparse
+    matrix, such that no dense (N, N) distance matrix is ever constructed.
+    Default: None
+cutoff : float, optional
+    If specified, the spatial weight matrix only includes neighbours no
+    further than `cutoff` (in mm) apart and is stored as a sparse matrix. Can
+    be combined with `n_neighbors`. Default: None\
 """,
     kwargs="""\
 kwargs : key-value pairs
@@ -131,14 +189,16 @@ nulls : np.ndarray
 
 
 def alexander_bloch(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
-                    n_perm=1000, seed=None, spins=None, surfaces=None):
+                    n_perm=1000, seed=None, spins=None, surfaces=None,
+                    n_proc=1, batch=False):
     if spins is None:
         if surfaces is None:
             surfaces = fetch_atlas(atlas, density)['sphere']
         coords, hemi = get_parcel_centroids(surfaces,
                                             parcellation=parcellation,
                                             method='surface')
-        spins = gen_spinsamples(coords, hemi, n_rotate=n_perm, seed=seed)
+        spins = gen_spinsamples(coords, hemi, n_rotate=n_perm, seed=seed,
+                                n_proc=n_proc, batch=batch)
     spins = load_spins(spins)
     if data is None:
         data = np.arange(len(spins))
@@ -161,6 +221,7 @@ Parameters
 {seed}
 {spins}
 {surfaces}
+{n_proc_spins}
 
 Returns
 -------
@@ -179,7 +240,8 @@ vazquez_rodriguez = alexander_bloch
 
 
 def vasa(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
-         n_perm=1000, seed=None, spins=None, surfaces=None):
+         n_perm=1000, seed=None, spins=None, surfaces=None,
+         n_proc=1, batch=False):
     if parcellation is None:
         raise ValueError('Cannot use `vasa()` null method without specifying '
                          'a parcellation. Use `alexander_bloch() instead if '
@@ -191,7 +253,7 @@ def vasa(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D10
                                             parcellation=parcellation,
                                             method='surface')
         spins = gen_spinsamples(coords, hemi, method='vasa', n_rotate=n_perm,
-                                seed=seed)
+                                seed=seed, n_proc=n_proc, batch=batch)
     spins = load_spins(spins)
     if data is None:
         data = np.arange(len(spins))
@@ -215,6 +277,7 @@ Parameters
 {seed}
 {spins}
 {surfaces}
+{n_proc_spins}
 
 Returns
 -------
@@ -230,7 +293,8 @@ References
 
 
 def hungarian(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
-              n_perm=1000, seed=None, spins=None, surfaces=None):
+              n_perm=1000, seed=None, spins=None, surfaces=None,
+              n_proc=1, batch=False):
     if parcellation is None:
         raise ValueError('Cannot use `hungarian()` null method without '
                          'specifying a parcellation. Use `alexander_bloch() '
@@ -242,7 +306,8 @@ def hungarian(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa
                                             parcellation=parcellation,
                                             method='surface')
         spins = gen_spinsamples(coords, hemi, method='hungarian',
-                                n_rotate=n_perm, seed=seed)
+                                n_rotate=n_perm, seed=seed, n_proc=n_proc,
+                                batch=batch)
     spins = load_spins(spins)
     if data is None:
         data = np.arange(len(spins))
@@ -266,6 +331,7 @@ Parameters
 {seed}
 {spins}
 {surfaces}
+{n_proc_spins}
 
 Returns
 -------
@@ -279,7 +345,8 @@ References
 
 
 def baum(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
-         n_perm=1000, seed=None, spins=None, surfaces=None):
+         n_perm=1000, seed=None, spins=None, surfaces=None,
+         n_proc=1, batch=False):
     if parcellation is None:
         raise ValueError('Cannot use `baum()` null method without specifying '
                          'a parcellation. Use `alexander_bloch() instead if '
@@ -287,7 +354,8 @@ def baum(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D10
     if surfaces is None:
         surfaces = fetch_atlas(atlas, density)['sphere']
     spins = spin_parcels(surfaces, parcellation,
-                         n_rotate=n_perm, spins=spins, seed=seed)
+                         n_rotate=n_perm, spins=spins, seed=seed,
+                         n_proc=n_proc, batch=batch)
     if data is None:
         data = np.arange(len(spins))
     data = load_data(data)
@@ -312,6 +380,7 @@ Parameters
 {seed}
 {spins}
 {surfaces}
+{n_proc_spins}
 
 Returns
 -------
@@ -327,7 +396,8 @@ References
 
 
 def cornblath(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
-              n_perm=1000, seed=None, spins=None, surfaces=None):
+              n_perm=1000, seed=None, spins=None, surfaces=None,
+              n_proc=1, batch=False):
     if parcellation is None:
         raise ValueError('Cannot use `cornblath()` null method without '
                          'specifying a parcellation. Use `alexander_bloch() '
@@ -336,7 +406,8 @@ def cornblath(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa
     if surfaces is None:
         surfaces = fetch_atlas(atlas, density)['sphere']
     nulls = spin_data(data, surfaces, parcellation,
-                      n_rotate=n_perm, spins=spins, seed=seed)
+                      n_rotate=n_perm, spins=spins, seed=seed,
+                      n_proc=n_proc, batch=batch)
     return nulls
 
 
@@ -356,6 +427,7 @@ Parameters
 {seed}
 {spins}
 {surfaces}
+{n_proc_spins}
 
 Returns
 -------
@@ -371,7 +443,8 @@ References
 
 
 def _get_distmat(hemisphere, atlas='fsaverage', density='10k',  # noqa: D103
-                 parcellation=None, drop=None, n_proc=1):
+                 parcellation=None, drop=None, n_proc=1, n_neighbors=None,
+                 cutoff=None, cache=True, method='mean', n_landmarks=None):
     hemi = HEMI.get(hemisphere, hemisphere)
     if hemi not in ('L', 'R'):
         raise ValueError(f'Invalid hemishere designation {hemisphere}')
@@ -379,14 +452,34 @@ def _get_distmat(hemisphere, atlas='fsaverage', density='10k',  # noqa: D103
     if drop is None:
         drop = PARCIGNORE
 
+    fn = None
+    if cache and _get_cache_size() > 0:
+        key = _distmat_cache_key(hemi, atlas, density, parcellation, drop,
+                                 n_neighbors, cutoff, method, n_landmarks)
+        try:
+            fn = _get_cache_dir() / key
+        except OSError:
+            # e.g., a read-only data directory: compute without caching
+            pass
+        else:
+            dist = _load_cached_distmat(fn)
+            if dist is not None:
+                return dist
+
     atlas = fetch_atlas(atlas, density)
     surf, medial = getattr(atlas['pial'], hemi), getattr(atlas['medial'], hemi)
     if parcellation is None:
-        dist = get_surface_distance(surf, medial=medial, n_proc=n_proc)
+        dist = get_surface_distance(surf, medial=medial, n_proc=n_proc,
+                                    n_neighbors=n_neighbors, cutoff=cutoff,
+                                    n_landmarks=n_landmarks, seed=0)
     else:
         dist = get_surface_distance(surf, parcellation=parcellation,
                                     medial_labels=drop, drop=drop,
-                                    n_proc=n_proc)
+                                    n_proc=n_proc, method=method)
+
+    if fn is not None:
+        _save_cached_distmat(fn, dist)
+
     return dist
 
 
@@ -407,17 +500,244 @@ drop : list-of-str, optional
     from the generate distance matrix. If not specified will ignore parcels
     generally indicative of the medial wall. Default: None
 {n_proc}
+{sparse}
+cache : bool, optional
+    Whether to load the distance matrix from (and store it in) the on-disk
+    distance matrix cache. Default: True
+method : {{'mean', 'centroid', 'min'}}, optional
+    If `parcellation` is not None, how parcel-parcel distances are defined
+    (see :func:`neuromaps.points.get_surface_distance`). Default: 'mean'
+n_landmarks : int, optional
+    If `parcellation` is None, approximate vertex distances using shortest
+    paths from this many landmark vertices (see
+    :func:`neuromaps.points.get_surface_distance`). Default: None
 
 Returns
 -------
-dist : (N, N) np.ndarray
+dist : (N, N) np.ndarray or scipy.sparse.csr_matrix
     Surface distance matrix between vertices. If a `parcellation` is specified
     then this will be the parcel-parcel distance matrix, where the distance
-    between parcels is the average distance between all constituent vertices
+    between parcels is the average distance between all constituent vertices.
+    If `n_neighbors` or `cutoff` are specified this is a sparse matrix of
+    distances between neighbouring vertices.
 """.format(**_nulls_input_docs)
 
 
+def _get_cache_dir():
+    """
+    Get directory in which surface distance matrices are cached.
+
+    Returns
+    -------
+    cache_dir : pathlib.Path
+        Path to `distmat_cache` in the neuromaps data directory
+    """
+    cache_dir = Path(get_data_dir()) / 'distmat_cache'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def _get_cache_size():
+    """
+    Get maximum size (in bytes) of the distance matrix cache.
+
+    Returns
+    -------
+    size : int
+        Value of the environmental variable 'NEUROMAPS_DISTMAT_CACHE_SIZE' if
+        set, otherwise 16 GiB. A size of 0 disables the cache
+    """
+    return int(os.environ.get('NEUROMAPS_DISTMAT_CACHE_SIZE',
+                              _DISTMAT_CACHE_SIZE))
+
+
+def _distmat_cache_key(hemi, atlas, density, parcellation=None, drop=None,
+                       n_neighbors=None, cutoff=None, method='mean',
+                       n_landmarks=None):
+    """
+    Generate content-addressed cache key for a surface distance matrix.
+
+    Parameters
+    ----------
+    hemi : {'L', 'R'}
+        Hemisphere of distance matrix
+    atlas, density : str
+        Atlas and density of surface mesh
+    parcellation : str or os.PathLike or nib.GiftiImage, optional
+        Parcellation image. The key depends on the labels and label names it
+        contains, not on its filepath. Default: None
+    drop : list of str, optional
+        Names of parcels that are dropped. Default: None
+    n_neighbors, cutoff : int or float, optional
+        Options for sparse distance matrices. Default: None
+    method : str, optional
+        Definition of parcel-parcel distances. Default: 'mean'
+    n_landmarks : int, optional
+        Number of landmarks used to approximate vertex distances. Default:
+        None
+
+    Returns
+    -------
+    key : str
+        Filename of cached distance matrix
+
+    Notes
+    -----
+    Keys also depend on `_DISTMAT_CACHE_VERSION`, such that distance matrices
+    cached by versions computing them differently are never reused.
+    """
+    key = dict(version=_DISTMAT_CACHE_VERSION, atlas=_sanitize_atlas(atlas),
+               density=str(density), hemi=hemi, drop=sorted(drop or []),
+               n_neighbors=n_neighbors, cutoff=cutoff, method=method,
+               n_landmarks=n_landmarks, parcellation=None)
+    if parcellation is not None:
+        parc = load_gifti(parcellation)
+        labels = np.ascontiguousarray(parc.agg_data())
+        names = sorted(parc.labeltable.get_labels_as_dict().items())
+        digest = hashlib.sha256(labels.tobytes())
+        digest.update(json.dumps(names).encode())
+        key['parcellation'] = digest.hexdigest()
+    key = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    sparse_key = n_neighbors is not None or cutoff is not None
+    return key + ('.npz' if sparse_key else '.npy')
+
+
+def _load_cached_distmat(fn):
+    """
+    Load cached distance matrix `fn`, if it exists.
+
+    Dense distance matrices are memory-mapped. Loading a matrix marks it as
+    recently used.
+
+    Parameters
+    ----------
+    fn : pathlib.Path
+        Path to cached distance matrix
+
+    Returns
+    -------
+    dist : numpy.memmap or scipy.sparse.csr_matrix or None
+        Cached distance matrix, or None if `fn` is not cached
+    """
+    try:
+        if fn.suffix == '.npz':
+            dist = sparse.load_npz(fn).tocsr()
+        else:
+            dist = np.load(fn, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(fn)
+    except OSError:  # read-only cache
+        pass
+    return dist
+
+
+def _save_cached_distmat(fn, dist, max_size=None):
+    """
+    Save distance matrix `dist` to cache and evict least recently used files.
+
+    Files are written atomically, such that concurrent jobs never read partly
+    written distance matrices. Least recently used files are removed until
+    the total size of the cache is below `max_size`.
+
+    Parameters
+    ----------
+    fn : pathlib.Path
+        Path to cached distance matrix
+    dist : numpy.ndarray or scipy.sparse matrix
+        Distance matrix
+    max_size : int, optional
+        Maximum size (in bytes) of the cache. If not specified uses
+        :func:`_get_cache_size`. Default: None
+    """
+    if max_size is None:
+        max_size = _get_cache_size()
+
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(suffix=fn.suffix, dir=fn.parent)
+        with os.fdopen(fd, 'wb') as dest:
+            if sparse.issparse(dist):
+                sparse.save_npz(dest, sparse.csr_matrix(dist))
+            else:
+                np.save(dest, dist, allow_pickle=False)
+        os.replace(tmp, fn)
+    except OSError:
+        # the cache is best effort (e.g., the disk may be full or read-only)
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+        return
+
+    cached = []
+    for path in fn.parent.glob('*.np[yz]'):
+        try:
+            stat = path.stat()
+        except OSError:  # removed by another job
+            continue
+        cached.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in cached)
+    for _, size, path in sorted(cached, key=lambda x: x[0]):
+        if total <= max_size:
+            break
+        if path == fn:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        total -= size
+
+
+def _parcel_euclidean_distance(chunks, xyz, labels):
+    """
+    Get summed Euclidean distance between voxels in `chunks` and all parcels.
+
+    Voxels must be sorted by `labels`. Distances from the voxels in each chunk
+    are only calculated to voxels at or after the start of the chunk, such
+    that all chunks together cover every pair of voxels once.
+
+    Parameters
+    ----------
+    chunks : list of (int, int) tuple
+        Start and end indices of chunks of voxels
+    xyz : (N, 3) array_like
+        Coordinates of all voxels, sorted by `labels`
+    labels : (N,) array_like
+        Sorted index (from 0 to P - 1) of parcel to which each voxel belongs
+
+    Returns
+    -------
+    dist : (P, P) numpy.ndarray
+        Sum of distances between voxels in each parcel and voxels in each
+        parcel, for all pairs of voxels covered by `chunks`
+    """
+    def _reduce(block, rows, cols):
+        # sum distances over the voxels of every parcel in both dimensions
+        rlab, rstart = np.unique(rows, return_index=True)
+        clab, cstart = np.unique(cols, return_index=True)
+        block = np.add.reduceat(np.add.reduceat(block, cstart, axis=1),
+                                rstart, axis=0)
+        return rlab, clab, block
+
+    dist = np.zeros((labels[-1] + 1, labels[-1] + 1))
+    for start, end in chunks:
+        block = cdist(xyz[start:end], xyz[start:])
+        rlab, clab, inner = _reduce(block[:, :end - start],
+                                    labels[start:end], labels[start:end])
+        dist[np.ix_(rlab, clab)] += inner
+        # pairs with voxels after the chunk count in both directions
+        if end < len(labels):
+            rlab, clab, outer = _reduce(block[:, end - start:],
+                                        labels[start:end], labels[end:])
+            dist[np.ix_(rlab, clab)] += outer
+            dist[np.ix_(clab, rlab)] += outer.T
+
+    return dist
+
+
 def _surf_surrogates(data, atlas, density, parcellation, distmat, n_proc,
+                     n_neighbors=None, cutoff=None, hemispheres=(0, 1),
                      **kwargs):
 
     data = load_data(data)
@@ -426,11 +746,20 @@ def _surf_surrogates(data, atlas, density, parcellation, distmat, n_proc,
         parcellation = (None, None)
 
     for n, (hemi, parc) in enumerate(zip(('L', 'R'), parcellation)):
+        if n not in hemispheres:
+            continue
+        local = n_neighbors is not None or cutoff is not None
         if distmat is None:
             dist = _get_distmat(hemi, atlas=atlas, density=density,
-                                parcellation=parc, n_proc=n_proc)
+                                parcellation=parc, n_proc=n_proc,
+                                n_neighbors=n_neighbors, cutoff=cutoff)
         else:
             dist = distmat[n]
+            if isinstance(dist, CondensedDistance):
+                dist = dist.toarray()
+            if local:
+                dist = sparsify_distance(dist, n_neighbors=n_neighbors,
+                                         cutoff=cutoff)
 
         if parc is None:
             idx = np.arange(n * (len(data) // 2), (n + 1) * (len(data) // 2))
@@ -438,13 +767,21 @@ def _surf_surrogates(data, atlas, density, parcellation, distmat, n_proc,
             idx = np.trim_zeros(np.unique(load_data(parc))) - 1
 
         hdata = np.squeeze(data[idx])
-        med = np.isinf(dist + np.diag([np.inf] * len(dist))).all(axis=1)
+        if sparse.issparse(dist):
+            # vertices without any neighbours are on the medial wall
+            med = dist.getnnz(axis=1) == 0
+        else:
+            med = np.isinf(dist + np.diag([np.inf] * len(dist))).all(axis=1)
         mask = np.logical_not(np.logical_or(np.isnan(hdata), med))
 
-        yield hdata[mask], dist[np.ix_(mask, mask)], None, idx[mask]
+        if sparse.issparse(dist):
+            yield hdata[mask], dist[mask][:, mask], idx[mask]
+        else:
+            yield hdata[mask], dist[np.ix_(mask, mask)], idx[mask]
 
 
 def _vol_surrogates(data, atlas, density, parcellation, distmat, tempdir=None,
+                    n_neighbors=None, cutoff=None, knn=None, n_proc=1,
                     **kwargs):
 
     if atlas != 'MNI152':
@@ -487,65 +824,126 @@ def _vol_surrogates(data, atlas, density, parcellation, distmat, tempdir=None,
     xyz = nib.affines.apply_affine(affine, np.column_stack(np.where(mask)))
 
     # calculate distance matrix
-    index = None
-    if distmat is None:
-        if parcellation is None:  # memmap because BIG
-            distout = tempfile.NamedTemporaryFile(suffix='.mmap', dir=tempdir)
-            dist = np.memmap(distout, mode='w+', dtype='float32',
-                             shape=(len(xyz), len(xyz)))
-            indout = tempfile.NamedTemporaryFile(suffix='.mmap', dir=tempdir)
-            index = np.memmap(indout, mode='w+', dtype='int32',
-                              shape=(len(xyz), len(xyz)))
-            for n, row in enumerate(xyz):
-                xyz_dist = cdist(row[None], xyz).astype('float32')
-                index[n] = np.argsort(xyz_dist, axis=-1).astype('int32')
-                dist[n] = xyz_dist[:, index[n]]
-                dist.flush()
-                index.flush()
+    distdir = None
+    local = n_neighbors is not None or cutoff is not None
+    if local and distmat is None and parcellation is None:
+        # only neighbouring voxels are needed so use a k-d tree instead of
+        # computing all pairwise distances
+        tree = cKDTree(xyz)
+        if n_neighbors is not None:
+            upper = np.inf if cutoff is None else cutoff
+            nd, ni = tree.query(xyz, k=min(n_neighbors + 1, len(xyz)),
+                                distance_upper_bound=upper)
+            rows = np.broadcast_to(np.arange(len(xyz))[:, None], ni.shape)
+            valid = ni < len(xyz)
+            dist = sparse.coo_matrix((nd[valid], (rows[valid], ni[valid])),
+                                     shape=(len(xyz), len(xyz)))
+        else:
+            dist = tree.sparse_distance_matrix(tree, cutoff,
+                                               output_type='coo_matrix')
+    elif distmat is None:
+        if parcellation is None and knn is not None:
+            # burt2020 only needs the `knn` nearest neighbours of every voxel
+            # (sorted, the voxel itself first) so query them from a k-d tree
+            nd, ni = cKDTree(xyz).query(xyz, k=min(knn + 1, len(xyz)),
+                                        workers=effective_n_jobs(n_proc))
+            dist = (nd.astype('float32'), ni.astype('int32'))
+        elif parcellation is None:  # store on disk because BIG
+            distdir = tempfile.mkdtemp(dir=tempdir)
+            dist = CondensedDistance.create(
+                distdir, lambda rows: cdist(xyz[rows], xyz), len(xyz),
+                n_neighbors=0
+            )
         else:
-            parcellation = darr[mask]
-            row_dist = np.zeros((len(xyz), len(labels)), dtype='float32')
-            dist = np.zeros((len(labels), len(labels)), dtype='float32')
-            for n, row in enumerate(xyz):
-                xyz_dist = cdist(row[None], xyz).astype('float32')
-                row_dist[n] = ndimage.mean(xyz_dist, parcellation, labels)
-            for n in range(len(labels)):
-                dist[n] = ndimage.mean(row_dist[:, n], parcellation, labels)
+            # mean distance between all voxels of every pair of parcels;
+            # voxels are sorted by parcel and chunks of the upper triangle are
+            # dealt round-robin to workers to balance their load
+            parcellation = np.searchsorted(labels, darr[mask])
+            order = np.argsort(parcellation, kind='stable')
+            chunks = [(start, min(start + 100, len(xyz)))
+                      for start in range(0, len(xyz), 100)]
+            n_proc = min(effective_n_jobs(n_proc), len(chunks))
+            dist = sum(Parallel(n_jobs=n_proc)(
+                delayed(_parcel_euclidean_distance)(
+                    chunks[n::n_proc], xyz[order], parcellation[order]
+                ) for n in range(n_proc)
+            ))
+            count = np.bincount(parcellation, minlength=len(labels))
+            dist = (dist / np.outer(count, count)).astype('float32')
 
     else:
         dist = distmat
-        if parcellation is None:
-            index = np.argsort(dist, axis=-1)
 
-    if parcellation is None:
-        yield darr[mask], dist, index, mask
-    else:
-        yield data, dist, index, np.ones(len(labels), dtype=bool)
+    if local:
+        dist = sparsify_distance(dist, n_neighbors=n_neighbors, cutoff=cutoff)
+
+    try:
+        if parcellation is None:
+            yield darr[mask], dist, mask
+        else:
+            yield data, dist, np.ones(len(labels), dtype=bool)
+    finally:
+        if distdir is not None:
+            shutil.rmtree(distdir, ignore_errors=True)
 
 
 def _make_surrogates(data, method, atlas='fsaverage', density='10k',
                      parcellation=None, n_perm=1000, seed=None, distmat=None,
-                     n_proc=1, tempdir=None, **kwargs):
+                     n_proc=1, tempdir=None, dtype='float64', n_neighbors=None,
+                     cutoff=None, **kwargs):
     if method not in ('burt2018', 'burt2020', 'moran'):
         raise ValueError(f'Invalid null method: {method}')
+    if method != 'burt2018' and (n_neighbors is not None
+                                 or cutoff is not None):
+        raise ValueError('Sparse spatial weight matrices (`n_neighbors`, '
+                         '`cutoff`) are only available for the burt2018 '
+                         f'null method, not {method}')
 
     atlas = _sanitize_atlas(atlas)
     darr = load_data(data)
-    surrogates = np.full((darr.shape) + (n_perm,), np.nan)
-    genfunc = _vol_surrogates if atlas == 'MNI152' else _surf_surrogates
-    for hdata, hdist, hind, hsl in genfunc(data, atlas, density,
-                                           parcellation, distmat,
-                                           n_proc=n_proc, tempdir=tempdir):
+    surrogates = np.full((darr.shape) + (n_perm,), np.nan, dtype=dtype)
+
+    # each generator yields the data + distance matrix for one hemisphere (or
+    # the whole volume); hemispheres are processed concurrently, splitting
+    # `n_proc` between them
+    genopts = dict(tempdir=tempdir, n_neighbors=n_neighbors, cutoff=cutoff)
+    knn = kwargs.get('knn', 1000) if method == 'burt2020' else None
+    if atlas == 'MNI152':
+        n_tasks, n_outer, n_proc = 1, 1, effective_n_jobs(n_proc)
+    else:
+        n_tasks = 2
+        n_outer, n_proc = _split_n_proc(n_proc, n_tasks)
+
+    def _generator(n):
+        if atlas == 'MNI152':
+            return _vol_surrogates(data, atlas, density, parcellation,
+                                   distmat, knn=knn, n_proc=n_proc, **genopts)
+        return _surf_surrogates(data, atlas, density, parcellation, distmat,
+                                n_proc=n_proc, hemispheres=(n,), **genopts)
+
+    def _generate(n):
+        # parallel jobs nested in a hemisphere process would default to
+        # threads, where GIL-bound work (e.g., shortest paths) uses one core
+        with parallel_backend('loky', inner_max_num_threads=1):
+            return _generate_hemi(_generator(n))
+
+    def _generate_hemi(genfunc):
+        hdata, hdist, hsl = next(genfunc)
+        # burt2020 only needs the nearest neighbours of every voxel / vertex
+        if (isinstance(hdist, CondensedDistance)
+                and (method != 'burt2020' or parcellation is not None)):
+            hdist = hdist.toarray()
         if method == 'burt2018':
-            if parcellation is None:
-                if hind is not None:
-                    hdist = np.take_along_axis(
-                        hdist, np.argsort(hind, axis=-1), axis=-1)
             hdata += np.abs(np.nanmin(darr)) + 0.1
-            hsurr = batch_surrogates(hdist, hdata, n_surr=n_perm, seed=seed)
+            hsurr = batch_surrogates(hdist, hdata, n_surr=n_perm, seed=seed,
+                                     n_jobs=n_proc, **kwargs)
         elif method == 'burt2020':
             if parcellation is None:
-                if hind is None:
+                if isinstance(hdist, tuple):
+                    hdist, hind = hdist
+                elif isinstance(hdist, CondensedDistance):
+                    hdist, hind = hdist.knn(min(knn, len(hdist) - 1))
+                else:
                     hind = np.argsort(hdist, axis=-1)
                     hdist = np.sort(hdist, axis=-1)
                 hsurr = Sampled(hdata, hdist, hind, n_jobs=n_proc,
@@ -554,18 +952,7 @@ def _make_surrogates(data, method, atlas='fsaverage', density='10k',
                 hsurr = Base(hdata, hdist, seed=seed, **kwargs)(n_perm, 50).T
             if hsurr.ndim == 1:
                 hsurr = np.expand_dims(hsurr, axis=1)
-            # clean up (FIXME: this is ugly and we should fix it)
-            if hasattr(hdist, 'filename'):
-                hdist._mmap.close()
-                hind._mmap.close()
-                os.unlink(hdist.filename)
-                os.unlink(hind.filename)
-                del hdist, hind
         elif method == 'moran':
-            if parcellation is None:
-                if hind is not None:
-                    hdist = np.take_along_axis(
-                        hdist, np.argsort(hind, axis=-1), axis=-1)
             dist = hdist.astype('float64')
             np.fill_diagonal(dist, 1)
             dist **= -1
@@ -574,6 +961,19 @@ def _make_surrogates(data, method, atlas='fsaverage', density='10k',
             mrs = MoranRandomization(**opts)
             hsurr = mrs.fit(dist).randomize(hdata).T
 
+        genfunc.close()  # removes temporary distance matrices
+        return hsurr, hsl
+
+    # hemispheres are run in separate processes, each of which may use
+    # `n_proc` BLAS / OpenMP threads or start `n_proc` single-threaded workers
+    if n_outer > 1:
+        with parallel_backend('loky', inner_max_num_threads=n_proc):
+            out = Parallel(n_jobs=n_outer)(
+                delayed(_generate)(n) for n in range(n_tasks)
+            )
+    else:
+        out = [_generate(n) for n in range(n_tasks)]
+    for hsurr, hsl in out:
         surrogates[hsl] = hsurr
 
     return surrogates
@@ -592,8 +992,10 @@ method : {{'burt2018', 'burt2020', 'moran'}}
 {n_perm}
 {seed}
 {distmat}
-{n_proc}
+{n_proc_surrogates}
 {tempdir}
+{dtype}
+{sparse}
 {kwargs}
 
 Returns
@@ -604,11 +1006,12 @@ Returns
 
 def burt2018(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
              n_perm=1000, seed=None, distmat=None, tempdir=None, n_proc=1,
-             **kwargs):
+             dtype='float64', n_neighbors=None, cutoff=None, **kwargs):
     return _make_surrogates(data, 'burt2018', atlas=atlas, density=density,
                             parcellation=parcellation, n_perm=n_perm,
                             seed=seed, n_proc=n_proc, distmat=distmat,
-                            tempdir=tempdir, **kwargs)
+                            tempdir=tempdir, dtype=dtype,
+                            n_neighbors=n_neighbors, cutoff=cutoff, **kwargs)
 
 
 burt2018.__doc__ = """\
@@ -624,14 +1027,30 @@ Parameters
 {parcellation}
 {n_perm}
 {seed}
+{n_proc_surrogates}
 {distmat}
 {tempdir}
+{dtype}
+{sparse}
 {kwargs}
 
 Returns
 -------
 {nulls}
 
+Notes
+-----
+Surface distance matrices computed by this function (and by
+:func:`burt2020` and :func:`moran`) are cached as `.npy` files in the
+`distmat_cache` folder of the neuromaps data directory, keyed by the atlas,
+density, hemisphere, parcellation contents, dropped parcels, and the options
+used to compute them. Cached matrices are memory-mapped and reused by later
+calls. When the cache grows beyond the size (in bytes) set by the
+environmental variable 'NEUROMAPS_DISTMAT_CACHE_SIZE' (default: 16 GiB) the
+least recently used matrices are removed; setting it to 0 disables the cache.
+If the data directory is not writable distance matrices are computed without
+being cached.
+
 References
 ----------
 .. [SN6] Burt, J. B., Demirtaş, M., Eckner, W. J., Navejar, N. M., Ji, J. L.,
@@ -643,7 +1062,7 @@ References
 
 def burt2020(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
              n_perm=1000, seed=None, distmat=None, n_proc=1, tempdir=None,
-             **kwargs):
+             dtype='float64', **kwargs):
     if not _brainsmash_avail:
         raise ImportError('Cannot run burt2020 null model when `brainsmash` '
                           'is not installed. Please `pip install brainsmash` '
@@ -655,7 +1074,7 @@ def burt2020(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa:
     return _make_surrogates(data, 'burt2020', atlas=atlas, density=density,
                             parcellation=parcellation, n_perm=n_perm,
                             seed=seed, n_proc=n_proc, distmat=distmat,
-                            tempdir=tempdir, **kwargs)
+                            tempdir=tempdir, dtype=dtype, **kwargs)
 
 
 burt2020.__doc__ = """\
@@ -671,9 +1090,10 @@ Parameters
 {parcellation}
 {n_perm}
 {seed}
-{n_proc}
+{n_proc_surrogates}
 {distmat}
 {tempdir}
+{dtype}
 {kwargs}
 
 Returns
@@ -691,7 +1111,7 @@ References
 
 def moran(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D103
           n_perm=1000, seed=None, distmat=None, tempdir=None, n_proc=1,
-          **kwargs):
+          dtype='float64', **kwargs):
     if not _brainspace_avail:
         raise ImportError('Cannot run moran null model when `brainspace` is '
                           'not installed. Please `pip install brainspace` and '
@@ -699,7 +1119,7 @@ def moran(data, atlas='fsaverage', density='10k', parcellation=None,  # noqa: D1
     return _make_surrogates(data, 'moran', atlas=atlas, density=density,
                             parcellation=parcellation, n_perm=n_perm,
                             seed=seed, n_proc=n_proc, distmat=distmat,
-                            tempdir=tempdir, **kwargs)
+                            tempdir=tempdir, dtype=dtype, **kwargs)
 
 
 moran.__doc__ = """\
@@ -717,9 +1137,10 @@ Parameters
 {parcellation}
 {n_perm}
 {seed}
-{n_proc}
+{n_proc_surrogates}
 {distmat}
 {tempdir}
+{dtype}
 {kwargs}
 
 Returns
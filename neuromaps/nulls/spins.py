@@ -4,6 +4,7 @@
 from pathlib import Path
 import warnings
 
+from joblib import Parallel, delayed, effective_n_jobs
 import numpy as np
 from scipy import optimize, spatial
 try:  # scipy >= 1.8.0
@@ -153,7 +154,7 @@ def _gen_rotation(seed=None):
 
     Parameters
     ----------
-    seed : {int, np.random.RandomState instance, None}, optional
+    seed : {int, np.random.RandomState or np.random.Generator instance, None}
         Seed for random number generation
 
     Returns
@@ -161,7 +162,10 @@ def _gen_rotation(seed=None):
     rotate_{l,r} : (3, 3) numpy.ndarray
         Rotations for left and right hemisphere coordinates, respectively
     """
-    rs = check_random_state(seed)
+    if isinstance(seed, np.random.Generator):
+        rs = seed
+    else:
+        rs = check_random_state(seed)
 
     # for reflecting across Y-Z plane
     reflect = np.array([[-1, 0, 0], [0, 1, 0], [0, 0, 1]])
@@ -178,9 +182,190 @@ def _gen_rotation(seed=None):
     return rotate_l, rotate_r
 
 
+def _match_rotation(coor, rotated, method='original', n_proc=1):
+    """
+    Match coordinates `coor` to `rotated` coordinates.
+
+    Parameters
+    ----------
+    coor : (N, 3) array_like
+        Coordinates to be matched
+    rotated : (N, 3) array_like
+        Rotated `coor`
+    method : {'original', 'vasa', 'hungarian'}, optional
+        Method by which to match coordinates (see :func:`gen_spinsamples`).
+        Default: 'original'
+    n_proc : int, optional
+        Number of threads used when `method` is 'original'. Default: 1
+
+    Returns
+    -------
+    col : (N,) numpy.ndarray
+        Index of rotated coordinate assigned to each coordinate in `coor`
+    cost : (N,) numpy.ndarray
+        Euclidean distance between each coordinate and its assignment
+    """
+    # if we need an "exact" mapping (i.e., each node needs to be assigned
+    # EXACTLY once) then we have to calculate the full distance matrix which
+    # is a nightmare with respect to memory for anything that isn't
+    # parcellated data.
+    # that is, don't do this with vertex coordinates!
+    if method == 'vasa':
+        dist = spatial.distance_matrix(coor, rotated)
+        # min of max a la Vasa et al., 2018
+        col = np.zeros(len(coor), dtype='int32')
+        cost = np.zeros(len(coor))
+        for _ in range(len(dist)):
+            # find parcel whose closest neighbor is farthest away overall;
+            # assign to that
+            row = dist.min(axis=1).argmax()
+            col[row] = dist[row].argmin()
+            cost[row] = dist[row, col[row]]
+            # set to -inf and inf so they can't be assigned again
+            dist[row] = -np.inf
+            dist[:, col[row]] = np.inf
+    # optimization of total cost using Hungarian algorithm. this may result in
+    # certain parcels having higher cost than with `method='vasa'` but should
+    # always result in the total cost being lower #tradeoffs
+    elif method == 'hungarian':
+        dist = spatial.distance_matrix(coor, rotated)
+        row, col = optimize.linear_sum_assignment(dist)
+        cost = dist[row, col]
+    # if nodes can be assigned multiple targets, we can simply use the
+    # absolute minimum of the distances (no optimization required) which is
+    # _much_ lighter on memory
+    # huge thanks to https://stackoverflow.com/a/47779290 for this
+    # memory-efficient method
+    elif method == 'original':
+        cost, col = spatial.cKDTree(rotated).query(coor, 1, workers=n_proc)
+
+    return col, cost
+
+
+def _query_rotations(tree, coor, rotations, n_proc=1, chunk_size=2**20):
+    """
+    Match `coor` to their nearest neighbours after each of `rotations`.
+
+    Rather than building a tree on the rotated coordinates for every rotation
+    this queries a single `tree` built on `coor` with the inversely rotated
+    coordinates, which yields the same assignments since rotations preserve
+    Euclidean distances.
+
+    Parameters
+    ----------
+    tree : scipy.spatial.cKDTree
+        Tree built on `coor`
+    coor : (N, 3) array_like
+        Coordinates to be matched
+    rotations : (R, 3, 3) array_like
+        Rotations applied to `coor`
+    n_proc : int, optional
+        Number of threads used to query `tree`. Default: 1
+    chunk_size : int, optional
+        Approximate number of points queried at once, which bounds memory
+        usage when matching many rotations. Default: 2**20
+
+    Returns
+    -------
+    col : (N, R) numpy.ndarray
+        Index of rotated coordinate assigned to each coordinate in `coor`
+    cost : (N, R) numpy.ndarray
+        Euclidean distance between each coordinate and its assignment
+    """
+    rotations = np.asarray(rotations)
+    col = np.zeros((len(coor), len(rotations)), dtype=int)
+    cost = np.zeros((len(coor), len(rotations)))
+    step = max(1, chunk_size // max(len(coor), 1))
+    for start in range(0, len(rotations), step):
+        rot = rotations[start:start + step]
+        # x @ rot.T is the inverse rotation of x (rotations are orthogonal)
+        query = (coor @ rot.transpose(0, 2, 1)).reshape(-1, 3)
+        dist, idx = tree.query(query, 1, workers=n_proc)
+        col[:, start:start + step] = idx.reshape(len(rot), -1).T
+        cost[:, start:start + step] = dist.reshape(len(rot), -1).T
+
+    return col, cost
+
+
+def _spin_batch(coords, hemiid, seeds, method='original'):
+    """
+    Generate resampling arrays for rotations drawn from `seeds`.
+
+    Parameters
+    ----------
+    coords : (N, 3) array_like
+        X, Y, Z coordinates of nodes defined on a sphere
+    hemiid : (N,) array_like
+        Hemisphere designation of `coords`
+    seeds : list of np.random.SeedSequence
+        Seed of each rotation
+    method : {'original', 'vasa', 'hungarian'}, optional
+        Method by which to match non- and rotated coordinates. Default:
+        'original'
+
+    Returns
+    -------
+    resampled : (N, R) numpy.ndarray
+        Resampling array of each rotation
+    cost : (N, R) numpy.ndarray
+        Cost of re-assigning each coordinate for each rotation
+    """
+    # (R, 2, 3, 3) array of left + right hemisphere rotations
+    rotations = np.array([_gen_rotation(seed=np.random.default_rng(seed))
+                          for seed in seeds])
+    resampled = np.zeros((len(coords), len(seeds)), dtype='int32')
+    cost = np.zeros((len(coords), len(seeds)))
+    inds = np.arange(len(coords), dtype=int)
+
+    for h in range(2):
+        hinds = hemiid == h
+        coor = coords[hinds]
+        if len(coor) == 0:
+            continue
+        if method == 'original':
+            col, cost[hinds] = _query_rotations(spatial.cKDTree(coor), coor,
+                                                rotations[:, h])
+            resampled[hinds] = inds[hinds][col]
+            continue
+        # apply all rotations of the batch at once
+        for n, rotated in enumerate(coor @ rotations[:, h]):
+            col, cost[hinds, n] = _match_rotation(coor, rotated, method)
+            resampled[hinds, n] = inds[hinds][col]
+
+    return resampled, cost
+
+
+def _is_duplicate(resampled, seen, spinsamples):
+    """
+    Check whether `resampled` was already stored in `spinsamples`.
+
+    Parameters
+    ----------
+    resampled : (N,) numpy.ndarray
+        Resampling array of a new rotation
+    seen : dict
+        Mapping from the hash of previous resampling arrays to the columns of
+        `spinsamples` in which they are stored
+    spinsamples : (N, R) numpy.ndarray
+        Previous resampling arrays
+
+    Returns
+    -------
+    key : int
+        Hash of `resampled`, to be added to `seen` if it is accepted
+    duplicated : bool
+        Whether `resampled` is identical to one of the previous arrays
+    """
+    key = hash(resampled.tobytes())
+    # hashes can collide, so arrays sharing a hash are compared exactly
+    duplicated = any(np.array_equal(resampled, spinsamples[:, n])
+                     for n in seen.get(key, ()))
+    return key, duplicated
+
+
 def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
                     method='original', seed=None, verbose=False,
-                    return_cost=False):
+                    return_cost=False, n_proc=1, batch=False):
     """
     Return a resampling array for `coords` obtained from rotations / spins.
 
@@ -226,6 +411,18 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     return_cost : bool, optional
         Whether to return cost array (specified as Euclidean distance) for each
         coordinate for each rotation Default: True
+    n_proc : int, optional
+        Number of threads used to match rotated coordinates when `method` is
+        'original' or, if `batch` is True, number of processes across which
+        rotations are distributed. Results do not depend on `n_proc`. If
+        negative will use max available processors plus 1 minus the specified
+        number. Default: 1 (no parallelization)
+    batch : bool, optional
+        Whether to generate all rotations up front, each from its own seed
+        spawned from `seed` (see :meth:`np.random.SeedSequence.spawn`), and
+        apply them in batches across `n_proc` processes. Rotations are then
+        different from (but equally random as) those generated one at a time
+        with the same `seed`. Default: False
 
     Returns
     -------
@@ -305,6 +502,7 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
                          .format(method, methods))
 
     seed = check_random_state(seed)
+    n_proc = effective_n_jobs(n_proc)
 
     coords = np.asanyarray(coords)
     hemiid = np.squeeze(np.asanyarray(hemiid, dtype='int8'))
@@ -332,8 +530,22 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     cost = np.zeros((len(coords), n_rotate))
     inds = np.arange(len(coords), dtype=int)
 
+    if batch:
+        _batch_spinsamples(coords, hemiid, spinsamples, cost, seed,
+                           check_duplicates, method, verbose, n_proc)
+        if return_cost:
+            return spinsamples, cost
+        return spinsamples
+
+    # with the original method every rotation queries the same tree, built
+    # once per hemisphere on the unrotated coordinates
+    trees = [None, None]
+    if method == 'original':
+        trees = [spatial.cKDTree(coords[hemiid == h])
+                 if np.any(hemiid == h) else None for h in range(2)]
+
     # generate rotations and resampling array!
-    msg, warned = '', False
+    msg, warned, seen = '', False, {}
     for n in range(n_rotate):
         count, duplicated = 0, True
 
@@ -351,51 +563,21 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
                 coor = coords[hinds]
                 if len(coor) == 0:
                     continue
-
-                # if we need an "exact" mapping (i.e., each node needs to be
-                # assigned EXACTLY once) then we have to calculate the full
-                # distance matrix which is a nightmare with respect to memory
-                # for anything that isn't parcellated data.
-                # that is, don't do this with vertex coordinates!
-                if method == 'vasa':
-                    dist = spatial.distance_matrix(coor, coor @ rot)
-                    # min of max a la Vasa et al., 2018
-                    col = np.zeros(len(coor), dtype='int32')
-                    for _ in range(len(dist)):
-                        # find parcel whose closest neighbor is farthest away
-                        # overall; assign to that
-                        row = dist.min(axis=1).argmax()
-                        col[row] = dist[row].argmin()
-                        cost[inds[hinds][row], n] = dist[row, col[row]]
-                        # set to -inf and inf so they can't be assigned again
-                        dist[row] = -np.inf
-                        dist[:, col[row]] = np.inf
-                # optimization of total cost using Hungarian algorithm. this
-                # may result in certain parcels having higher cost than with
-                # `method='vasa'` but should always result in the total cost
-                # being lower #tradeoffs
-                elif method == 'hungarian':
-                    dist = spatial.distance_matrix(coor, coor @ rot)
-                    row, col = optimize.linear_sum_assignment(dist)
-                    cost[hinds, n] = dist[row, col]
-                # if nodes can be assigned multiple targets, we can simply use
-                # the absolute minimum of the distances (no optimization
-                # required) which is _much_ lighter on memory
-                # huge thanks to https://stackoverflow.com/a/47779290 for this
-                # memory-efficient method
-                elif method == 'original':
-                    dist, col = spatial.cKDTree(coor @ rot).query(coor, 1)
-                    cost[hinds, n] = dist
-
+                if method == 'original':
+                    col, cost[hinds, n:n + 1] = _query_rotations(
+                        trees[h], coor, rot[None], n_proc=n_proc
+                    )
+                    col = col[:, 0]
+                else:
+                    col, cost[hinds, n] = _match_rotation(coor, coor @ rot,
+                                                          method)
                 resampled[hinds] = inds[hinds][col]
 
             # if we want to check for duplicates ensure that we don't have any
             if check_duplicates:
-                if np.any(np.all(resampled[:, None] == spinsamples[:, :n], 0)):
-                    duplicated = True
+                key, duplicated = _is_duplicate(resampled, seen, spinsamples)
                 # if our "spin" is identical to the input then that's no good
-                elif np.all(resampled == inds):
-                    duplicated = True
+                duplicated = duplicated or np.array_equal(resampled, inds)
 
         # if we broke out because we tried 500 rotations and couldn't generate
         # a new one, warn that we're using duplicate rotations and give up.
@@ -407,6 +589,8 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
             warned = True
 
         spinsamples[:, n] = resampled
+        if check_duplicates:
+            seen.setdefault(key, []).append(n)
 
     if verbose:
         print(' ' * len(msg) + '\b' * len(msg), end='', flush=True)
@@ -417,6 +601,68 @@ def gen_spinsamples(coords, hemiid, n_rotate=1000, check_duplicates=True,
     return spinsamples
 
 
+def _batch_spinsamples(coords, hemiid, spinsamples, cost, seed,
+                       check_duplicates=True, method='original',
+                       verbose=False, n_proc=1):
+    """
+    Fill `spinsamples` and `cost` with rotations generated in batches.
+
+    See :func:`gen_spinsamples` for a description of the parameters. Every
+    rotation has its own seed (and retries of duplicated rotations use seeds
+    spawned from it), so results do not depend on `n_proc`.
+    """
+    n_rotate = spinsamples.shape[1]
+    inds = np.arange(len(coords), dtype=int)
+    seeds = np.random.SeedSequence(
+        seed.randint(np.iinfo(np.int32).max)
+    ).spawn(n_rotate)
+
+    todo, count = np.arange(n_rotate), np.zeros(n_rotate, dtype=int)
+    msg, seen, warned = '', {}, False
+    while len(todo) > 0:
+        if verbose:
+            msg = 'Generating {:>5} spins of {:>5}'.format(len(todo), n_rotate)
+            print(msg, end='\r', flush=True)
+
+        # first attempt uses the rotation's own seed, retries spawn new ones
+        rseeds = [seeds[n] if count[n] == 0 else seeds[n].spawn(1)[0]
+                  for n in todo]
+        count[todo] += 1
+        out = Parallel(n_jobs=n_proc)(
+            delayed(_spin_batch)(coords, hemiid, [rseeds[k] for k in chunk],
+                                 method)
+            for chunk in np.array_split(np.arange(len(todo)),
+                                        min(n_proc, len(todo)))
+        )
+        resampled = np.column_stack([res for res, _ in out])
+        rcost = np.column_stack([cst for _, cst in out])
+
+        # rotations are accepted in order; duplicated resamplings (or ones
+        # identical to the input) are retried up to 500 times
+        retry = []
+        for k, n in enumerate(todo):
+            if check_duplicates:
+                key, duplicated = _is_duplicate(resampled[:, k], seen,
+                                                spinsamples)
+                if duplicated or np.array_equal(resampled[:, k], inds):
+                    if count[n] < 500:
+                        retry.append(n)
+                        continue
+                    if not warned:
+                        warnings.warn('Duplicate rotations used. Check '
+                                      'resampling array to determine real '
+                                      'number of unique permutations.',
+                                      stacklevel=3)
+                        warned = True
+                seen.setdefault(key, []).append(n)
+            spinsamples[:, n] = resampled[:, k]
+            cost[:, n] = rcost[:, k]
+        todo = np.asarray(retry, dtype=int)
+
+    if verbose:
+        print(' ' * len(msg) + '\b' * len(msg), end='', flush=True)
+
+
 def spin_parcels(surfaces, parcellation, method='surface', n_rotate=1000,
                  spins=None, verbose=False, **kwargs):
     """
@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 """For testing neuromaps.nulls.nulls functionality."""
 
+import os
+from types import SimpleNamespace
+
+from joblib import Parallel, delayed
+import nibabel as nib
+import numpy as np
 import pytest
+from scipy.spatial import ConvexHull
+
+from neuromaps import nulls
 
 
 @pytest.mark.xfail
@@ -10,6 +19,41 @@ def test_alexander_bloch():
     assert False
 
 
+def test_alexander_bloch_seed(tmp_path):
+    """Test that alexander-bloch nulls are reproducible across versions."""
+    rs = np.random.default_rng(1234)
+    surfaces = []
+    for hemi in ('L', 'R'):
+        vert = rs.normal(size=(10, 3))
+        vert /= np.linalg.norm(vert, axis=1, keepdims=True)
+        faces = ConvexHull(vert).simplices
+        img = nib.GiftiImage(darrays=[
+            nib.gifti.GiftiDataArray(vert.astype('float32'),
+                                     'NIFTI_INTENT_POINTSET'),
+            nib.gifti.GiftiDataArray(faces.astype('int32'),
+                                     'NIFTI_INTENT_TRIANGLE')
+        ])
+        surfaces.append(tmp_path / f'sphere_{hemi}.surf.gii')
+        nib.save(img, surfaces[-1])
+
+    # resampling arrays generated by previous releases for the same seed
+    expected = np.array([
+        [4, 9, 0, 8, 0, 9, 8, 5, 3, 1, 18, 12, 11, 16, 19, 16, 17, 14, 10, 14],
+        [6, 1, 9, 1, 9, 3, 7, 9, 0, 7, 11, 18, 16, 14, 15, 11, 13, 11, 13, 11],
+        [3, 1, 6, 7, 6, 1, 7, 9, 2, 9, 12, 18, 14, 13, 17, 12, 19, 11, 12, 12]
+    ]).T
+    out = nulls.alexander_bloch(None, surfaces=surfaces, n_perm=3, seed=1234)
+    assert np.array_equal(out, expected)
+
+    # batched rotations are opt-in and do not depend on `n_proc`
+    batch = nulls.alexander_bloch(None, surfaces=surfaces, n_perm=3,
+                                  seed=1234, batch=True)
+    assert not np.array_equal(batch, expected)
+    assert np.array_equal(batch, nulls.alexander_bloch(
+        None, surfaces=surfaces, n_perm=3, seed=1234, batch=True, n_proc=2
+    ))
+
+
 @pytest.mark.xfail
 def test_vasa():
     """Test vasa null model."""
@@ -40,6 +84,111 @@ def test__get_distmat():
     assert False
 
 
+def test__distmat_cache(tmp_path, monkeypatch):
+    """Test on-disk caching of surface distance matrices."""
+    monkeypatch.setenv('NEUROMAPS_DATA', str(tmp_path))
+    key = nulls.nulls._distmat_cache_key('L', 'fsaverage', '10k')
+    assert key == nulls.nulls._distmat_cache_key('L', 'fsaverage', '10k')
+    assert key != nulls.nulls._distmat_cache_key('R', 'fsaverage', '10k')
+    assert nulls.nulls._distmat_cache_key('L', 'fsaverage', '10k',
+                                          n_neighbors=5).endswith('.npz')
+    for opts in (dict(method='min'), dict(n_landmarks=100)):
+        assert key != nulls.nulls._distmat_cache_key('L', 'fsaverage', '10k',
+                                                     **opts)
+    with monkeypatch.context() as m:
+        m.setattr(nulls.nulls, '_DISTMAT_CACHE_VERSION', -1)
+        assert key != nulls.nulls._distmat_cache_key('L', 'fsaverage', '10k')
+
+    cache_dir = nulls.nulls._get_cache_dir()
+    assert nulls.nulls._load_cached_distmat(cache_dir / key) is None
+    rs = np.random.default_rng(1234)
+    dist = [rs.random(size=(100, 100)) for _ in range(3)]
+    for n, d in enumerate(dist):
+        nulls.nulls._save_cached_distmat(cache_dir / f'{n}.npy', d)
+        os.utime(cache_dir / f'{n}.npy', (n, n))
+    out = nulls.nulls._load_cached_distmat(cache_dir / '0.npy')
+    assert isinstance(out, np.memmap) and np.allclose(out, dist[0])
+
+    # least recently used distance matrices are evicted first
+    nulls.nulls._save_cached_distmat(cache_dir / '3.npy', dist[0],
+                                     max_size=3 * 80128)
+    assert sorted(f.name for f in cache_dir.iterdir()) == \
+        ['0.npy', '2.npy', '3.npy']
+
+    # failing to write to the cache is not an error
+    nulls.nulls._save_cached_distmat(tmp_path / 'missing' / '4.npy', dist[0])
+    assert not (tmp_path / 'missing').exists()
+
+
+def test__get_distmat_read_only(monkeypatch):
+    """Test computing distance matrices without a writable cache."""
+
+    def _get_cache_dir():
+        raise PermissionError('read-only file system')
+
+    monkeypatch.setattr(nulls.nulls, '_get_cache_dir', _get_cache_dir)
+    monkeypatch.setattr(nulls.nulls, 'fetch_atlas', lambda atlas, density: {
+        'pial': SimpleNamespace(L='pial.gii'),
+        'medial': SimpleNamespace(L='medial.gii')
+    })
+    monkeypatch.setattr(nulls.nulls, 'get_surface_distance',
+                        lambda surf, **kwargs: np.eye(3))
+    assert np.allclose(nulls.nulls._get_distmat('L'), np.eye(3))
+
+
+def test__vol_surrogates_knn(tmp_path, monkeypatch):
+    """Test querying nearest voxels for volumetric burt2020 nulls."""
+    rs = np.random.default_rng(1234)
+    data = rs.random((6, 7, 8))
+    data[:2, :3] = 0
+    affine = np.diag([2., 2., 2., 1.])
+    brainmask = np.ones(data.shape)
+    fns = {}
+    for key, img in (('2009cAsym_T1w', data),
+                     ('2009cAsym_brainmask', brainmask)):
+        fns[key] = tmp_path / f'{key}.nii.gz'
+        nib.save(nib.Nifti1Image(img, affine), fns[key])
+    monkeypatch.setattr(nulls.nulls, 'fetch_atlas',
+                        lambda atlas, density: fns)
+
+    gen = nulls.nulls._vol_surrogates(nib.Nifti1Image(data, affine),
+                                      'MNI152', '2mm', None, None, knn=10)
+    hdata, (dist, index), mask = next(gen)
+    gen.close()
+    assert dist.shape == index.shape == (mask.sum(), 11)
+
+    # identical to sorting the full distance matrix, as done previously
+    xyz = nib.affines.apply_affine(affine, np.column_stack(np.where(mask)))
+    full = np.linalg.norm(xyz[:, None] - xyz, axis=-1)
+    assert np.allclose(dist, np.sort(full, axis=1)[:, :11])
+    assert np.allclose(np.take_along_axis(full, index, axis=1), dist)
+    # the voxel itself comes first (at distance 0)
+    assert np.all(index[:, 0] == np.arange(len(xyz)))
+    assert np.all(dist[:, 0] == 0)
+    # neighbours only differ from argsort among voxels tied with the last one
+    order = np.argsort(full, axis=1)[:, :11]
+    for row, idx, ref in zip(full, index, order):
+        closer = row < row[idx[-1]]
+        assert set(idx[closer[idx]]) == set(ref[closer[ref]])
+        assert np.sum(closer) < 11
+
+
+def test__parcel_euclidean_distance():
+    """Test summing Euclidean distances between parcels in chunks."""
+    rs = np.random.default_rng(1234)
+    xyz = rs.random((250, 3))
+    labels = np.sort(rs.integers(5, size=250))
+    dist = np.linalg.norm(xyz[:, None] - xyz, axis=-1)
+    expected = np.array([[dist[np.ix_(labels == i, labels == j)].sum()
+                          for j in range(5)] for i in range(5)])
+
+    chunks = [(start, min(start + 30, 250)) for start in range(0, 250, 30)]
+    out = sum(nulls.nulls._parcel_euclidean_distance(chunks[n::3], xyz,
+                                                     labels)
+              for n in range(3))
+    assert np.allclose(out, expected)
+
+
 @pytest.mark.xfail
 def test__make_surrogates():
     """Test making surrogates."""
@@ -52,6 +201,45 @@ def test_burt2018():
     assert False
 
 
+def test_burt2018_n_proc():
+    """Test that burt2018 null maps do not depend on n_proc."""
+    rs = np.random.default_rng(1234)
+    distmat = []
+    for _ in range(2):
+        coords = rs.random((50, 3)) * 50
+        distmat.append(np.linalg.norm(coords[:, None] - coords, axis=-1))
+    data = rs.random(100)
+
+    expected = nulls.burt2018(data, distmat=distmat, n_perm=10, seed=1234)
+    out = nulls.burt2018(data, distmat=distmat, n_perm=10, seed=1234,
+                         n_proc=2)
+    assert expected.shape == (100, 10) and np.all(np.isfinite(expected))
+    assert np.allclose(expected, out)
+
+
+def test__make_surrogates_nested_processes(monkeypatch, tmp_path):
+    """Test that jobs nested in concurrent hemispheres use processes."""
+    rs = np.random.default_rng(1234)
+    coords = rs.random((20, 3)) * 50
+    distmat = np.linalg.norm(coords[:, None] - coords, axis=-1)
+
+    def _surf_surrogates(data, *args, n_proc=1, hemispheres=(0, 1), **kwargs):
+        n, = hemispheres
+        pids = Parallel(n_jobs=n_proc)(delayed(os.getpid)() for _ in range(4))
+        np.savetxt(tmp_path / f'{n}.txt', [os.getpid()] + pids, fmt='%d')
+        idx = np.arange(n * 20, (n + 1) * 20)
+        yield data[idx], distmat.copy(), idx
+
+    monkeypatch.setattr(nulls.nulls, '_surf_surrogates', _surf_surrogates)
+    out = nulls.nulls._make_surrogates(rs.random(40), 'burt2018', n_perm=2,
+                                       seed=1234, n_proc=4)
+    assert out.shape == (40, 2) and np.all(np.isfinite(out))
+    for n in range(2):
+        hemi, *inner = np.loadtxt(tmp_path / f'{n}.txt', dtype=int)
+        assert hemi != os.getpid()
+        assert not set(inner) & {hemi, os.getpid()}
+
+
 @pytest.mark.xfail
 def test_burt2020():
     """Test burt2020 null model."""
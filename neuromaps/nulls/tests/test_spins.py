@@ -3,6 +3,7 @@
 
 import numpy as np
 import pytest
+from scipy import spatial
 
 from neuromaps.nulls import spins
 
@@ -33,6 +34,81 @@ def test_gen_spinsamples():
     assert False
 
 
+def test_gen_spinsamples_batch():
+    """Test batched spin samples do not depend on `n_proc`."""
+    rs = np.random.default_rng(1234)
+    coords = rs.normal(size=(40, 3))
+    coords /= np.linalg.norm(coords, axis=1, keepdims=True)
+    hemiid = np.repeat([0, 1], 20)
+    spins1, cost1 = spins.gen_spinsamples(coords, hemiid, n_rotate=10,
+                                          seed=1234, batch=True,
+                                          return_cost=True)
+    spins2, cost2 = spins.gen_spinsamples(coords, hemiid, n_rotate=10,
+                                          seed=1234, batch=True, n_proc=2,
+                                          return_cost=True)
+    assert spins1.shape == (40, 10)
+    assert np.all(spins1[:20] < 20) and np.all(spins1[20:] >= 20)
+    assert np.array_equal(spins1, spins2)
+    assert np.allclose(cost1, cost2)
+
+    for batch in (False, True):
+        empty = spins.gen_spinsamples(coords, hemiid, n_rotate=0,
+                                      batch=batch, verbose=True)
+        assert empty.shape == (40, 0)
+
+
+def test_gen_spinsamples_original():
+    """Test matching rotations by querying a single tree per hemisphere."""
+    rs = np.random.default_rng(1234)
+    coords = rs.normal(size=(60, 3))
+    coords /= np.linalg.norm(coords, axis=1, keepdims=True)
+    hemiid = np.repeat([0, 1], 30)
+    out, cost = spins.gen_spinsamples(coords, hemiid, n_rotate=10, seed=1234,
+                                      check_duplicates=False,
+                                      return_cost=True)
+
+    # same as building a tree on the rotated coordinates for every rotation
+    seed = np.random.RandomState(1234)
+    for n in range(10):
+        for h, rot in enumerate(spins._gen_rotation(seed=seed)):
+            hinds = np.flatnonzero(hemiid == h)
+            coor = coords[hinds]
+            col, dist = spins._match_rotation(coor, coor @ rot)
+            assert np.array_equal(out[hinds, n], hinds[col])
+            assert np.allclose(cost[hinds, n], dist)
+
+    # and batches of rotations are matched in chunks
+    rotations = np.array([spins._gen_rotation(seed=n)[1] for n in range(10)])
+    tree = spatial.cKDTree(coords[30:])
+    col, dist = spins._query_rotations(tree, coords[30:], rotations,
+                                       chunk_size=70)
+    for n, rot in enumerate(rotations):
+        expected = spins._match_rotation(coords[30:], coords[30:] @ rot)
+        assert np.array_equal(col[:, n], expected[0])
+        assert np.allclose(dist[:, n], expected[1])
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_gen_spinsamples_duplicates(batch):
+    """Test duplicate spin samples are rejected."""
+    rs = np.random.default_rng(1234)
+    coords = rs.normal(size=(10, 3))
+    coords /= np.linalg.norm(coords, axis=1, keepdims=True)
+    hemiid = np.repeat([0, 1], 5)
+    spinsamples = spins.gen_spinsamples(coords, hemiid, n_rotate=50,
+                                        seed=1234, batch=batch)
+    assert len({tuple(col) for col in spinsamples.T}) == 50
+    assert not np.any(np.all(spinsamples == np.arange(10)[:, None], axis=0))
+
+    seen = {}
+    key, duplicated = spins._is_duplicate(spinsamples[:, 0], seen,
+                                          spinsamples)
+    assert not duplicated
+    seen[key] = [0]
+    assert spins._is_duplicate(spinsamples[:, 0].copy(), seen,
+                               spinsamples)[1]
+
+
 @pytest.mark.xfail
 def test_spin_parcels():
     """Test spinning parcels."""
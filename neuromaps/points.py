@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 """Functions for working with triangle meshes + surfaces."""
 
-from joblib import Parallel, delayed
+from functools import partial
+import json
+import os
+import shutil
+import tempfile
+
+from joblib import Parallel, delayed, effective_n_jobs
 import numpy as np
-from scipy import ndimage, sparse
+from scipy import sparse
+from scipy.spatial import cKDTree
 
 from neuromaps.images import load_gifti, relabel_gifti, PARCIGNORE
 
@@ -283,38 +290,712 @@ def make_surf_graph(vertices, faces, mask=None):
                              shape=(len(vertices), len(vertices)))
 
 
-def _get_graph_distance(vertex, graph, labels=None):
+def _get_graph_distance(vertices, graph, out=None, chunk_size=100):
     """
-    Get surface distance of `vertex` to all other vertices in `graph`.
+    Get surface distance of `vertices` to all other vertices in `graph`.
+
+    Shortest paths are computed for `chunk_size` source vertices at a time.
 
     Parameters
     ----------
-    vertex : int
-        Index of vertex for which to calculate surface distance
+    vertices : (B,) array_like
+        Indices of vertices for which to calculate surface distance
     graph : array_like
         Graph along which to calculate shortest path distances
-    labels : array_like, optional
-        Labels indicating parcel to which each vertex belongs. If provided,
-        distances will be averaged within distinct labels
+    out : (N, N) numpy.ndarray, optional
+        Array into whose rows `vertices` distances are written. Default: None
+    chunk_size : int, optional
+        Number of source vertices passed to Dijkstra's algorithm at once.
+        Default: 100
 
     Returns
     -------
-    dist : (N,) numpy.ndarray
-        Distance of `vertex` to all other vertices in `graph` (or to all
-        parcels in `labels`, if provided)
+    dist : (B, N) numpy.ndarray
+        Distance of `vertices` to all other vertices in `graph`. Only returned
+        if `out` is None
     """
-    dist = sparse.csgraph.dijkstra(graph, directed=False, indices=[vertex])
+    vertices = np.atleast_1d(vertices)
+    if out is None:
+        dist = np.empty((len(vertices), graph.shape[0]), dtype='float32')
+    else:
+        dist = out
 
-    if labels is not None:
-        dist = ndimage.mean(input=np.delete(dist, vertex),
-                            labels=np.delete(labels, vertex),
-                            index=np.unique(labels))
+    for n in range(0, len(vertices), chunk_size):
+        chunk = vertices[n:n + chunk_size]
+        block = sparse.csgraph.dijkstra(graph, directed=False, indices=chunk)
+        if out is None:
+            dist[n:n + chunk_size] = block
+        else:
+            dist[chunk] = block
+
+    if out is None:
+        return dist
+
+
+def _get_landmarks(vertices, graph, n_landmarks, seed=None):
+    """
+    Select `n_landmarks` landmark vertices spread evenly across `graph`.
+
+    Landmarks are chosen by farthest point sampling of the (Euclidean)
+    coordinates of all vertices that are connected to the graph.
+
+    Parameters
+    ----------
+    vertices : (N, 3) array_like
+        Coordinates of vertices in `graph`
+    graph : scipy.sparse.csr_matrix
+        Graph along which to calculate shortest path distances
+    n_landmarks : int
+        Number of landmarks to select
+    seed : {int, np.random.Generator instance, None}, optional
+        Seed for selecting the first landmark. Default: None
+
+    Returns
+    -------
+    landmarks : (L,) numpy.ndarray
+        Indices of landmark vertices
+    """
+    rs = np.random.default_rng(seed)
+    candidates = np.flatnonzero(graph.getnnz(axis=0) + graph.getnnz(axis=1))
+    coords = np.asarray(vertices, dtype='float64')[candidates]
+
+    landmarks = [rs.integers(len(candidates))]
+    mindist = np.linalg.norm(coords - coords[landmarks[0]], axis=1)
+    for _ in range(1, min(n_landmarks, len(candidates))):
+        landmarks.append(mindist.argmax())
+        mindist = np.minimum(mindist, np.linalg.norm(coords
+                                                     - coords[landmarks[-1]],
+                                                     axis=1))
+
+    return candidates[landmarks]
+
+
+def _get_landmark_distance(vertices, graph, ldist, limit, n_nearest=4,
+                           out=None, chunk_size=100):
+    """
+    Get approximate surface distance of `vertices` to all other vertices.
+
+    Distances shorter than `limit` are exact; longer distances are bounded
+    from above by the shortest path through any of the `n_nearest` landmarks
+    closest to either vertex.
+
+    Parameters
+    ----------
+    vertices : (B,) array_like
+        Indices of vertices for which to calculate surface distance
+    graph : array_like
+        Graph along which to calculate shortest path distances
+    ldist : (L, N) numpy.ndarray
+        Exact distance of landmark vertices to all vertices in `graph`
+    limit : float
+        Maximum distance up to which shortest paths are traced exactly
+    n_nearest : int, optional
+        Number of nearby landmarks through which paths are considered.
+        Default: 4
+    out : (N, N) numpy.ndarray, optional
+        Array into whose rows `vertices` distances are written. Default: None
+    chunk_size : int, optional
+        Number of source vertices passed to Dijkstra's algorithm at once.
+        Default: 100
+
+    Returns
+    -------
+    dist : (B, N) numpy.ndarray
+        Approximate distance of `vertices` to all other vertices in `graph`.
+        Only returned if `out` is None
+    """
+    vertices = np.atleast_1d(vertices)
+    n_nearest = min(n_nearest, len(ldist))
+    nearest = np.argpartition(ldist, n_nearest - 1, axis=0)[:n_nearest]
+    radius = np.take_along_axis(ldist, nearest, axis=0)
+    if out is None:
+        dist = np.empty((len(vertices), graph.shape[0]), dtype='float32')
+    else:
+        dist = out
+
+    for n in range(0, len(vertices), chunk_size):
+        chunk = vertices[n:n + chunk_size]
+        block = sparse.csgraph.dijkstra(graph, directed=False, indices=chunk,
+                                        limit=limit)
+        for near, rad in zip(nearest, radius):
+            np.minimum(block, rad[chunk, None] + ldist[near[chunk]],
+                       out=block)
+            np.minimum(block, (rad[:, None] + ldist[:, chunk][near]).T,
+                       out=block)
+        if out is None:
+            dist[n:n + chunk_size] = block
+        else:
+            dist[chunk] = block
+
+    if out is None:
+        return dist
+
+
+def _get_parcel_distance(vertices, graph, labels, chunk_size=100):
+    """
+    Get summed surface distance of `vertices` to all parcels in `labels`.
+
+    Distances of each source vertex are averaged within parcels (excluding
+    the source itself) and then summed within the parcel of the source, such
+    that only a (P, P) array is kept in memory.
+
+    Parameters
+    ----------
+    vertices : (B,) array_like
+        Indices of vertices for which to calculate surface distance
+    graph : array_like
+        Graph along which to calculate shortest path distances
+    labels : (N,) array_like
+        Labels indicating parcel to which each vertex belongs
+    chunk_size : int, optional
+        Number of source vertices passed to Dijkstra's algorithm at once.
+        Default: 100
+
+    Returns
+    -------
+    dist : (P, P) numpy.ndarray
+        Sum over `vertices` in each parcel of the average distance to all
+        vertices in each parcel, where P is the number of unique `labels`
+    """
+    vertices = np.atleast_1d(vertices)
+    labels = np.asarray(labels)
+    # only stored entries are multiplied, so infinite distances (e.g., to the
+    # medial wall) are not turned into NaNs
+    uniq, inv = np.unique(labels, return_inverse=True)
+    ind = sparse.csr_matrix((np.ones(len(labels)), (inv, np.arange(len(inv)))),
+                            shape=(len(uniq), len(labels)))
+    count = np.asarray(ind.sum(axis=1)).ravel()
+    ind_t = ind.T.tocsr()  # for fast row (i.e., source vertex) selection
+
+    dist = np.zeros((len(uniq), len(uniq)))
+    for n in range(0, len(vertices), chunk_size):
+        chunk = vertices[n:n + chunk_size]
+        block = sparse.csgraph.dijkstra(graph, directed=False, indices=chunk)
+        # average over all vertices in each parcel, excluding the source
+        ccount = np.broadcast_to(count, (len(chunk), len(count))).copy()
+        ccount[np.arange(len(chunk)), inv[chunk]] -= 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block = (ind @ block.T).T / ccount
+        dist += ind_t[chunk].T @ block
+
+    return dist
+
+
+def _get_parcel_min_distance(parcels, graph, labels):
+    """
+    Get minimum surface distance of `parcels` to all parcels in `labels`.
 
-    return dist.astype('float32')
+    Parameters
+    ----------
+    parcels : (B,) array_like
+        Labels of parcels for which to calculate surface distance
+    graph : array_like
+        Graph along which to calculate shortest path distances
+    labels : (N,) array_like
+        Labels indicating parcel to which each vertex belongs
+
+    Returns
+    -------
+    dist : (B, P) numpy.ndarray
+        Shortest distance between any vertex of each of `parcels` and any
+        vertex of each parcel, where P is the number of unique `labels`
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    _, start = np.unique(labels[order], return_index=True)
+
+    dist = np.empty((len(parcels), len(start)), dtype='float32')
+    for n, parc in enumerate(parcels):
+        # single multi-source shortest path tree rooted in all parcel vertices
+        row = sparse.csgraph.dijkstra(graph, directed=False, min_only=True,
+                                      indices=np.flatnonzero(labels == parc))
+        dist[n] = np.minimum.reduceat(row[order], start)
+
+    return dist
+
+
+def _get_sparse_graph_distance(vertices, graph, n_neighbors=None,
+                               cutoff=None, coords=None, chunk_size=100):
+    """
+    Get surface distance of `vertices` to their neighbours in `graph`.
+
+    Shortest paths are computed for `chunk_size` source vertices at a time.
+    If only `n_neighbors` is given and `coords` are provided, shortest paths
+    are not traced further than required to find the nearest neighbours (see
+    :func:`_get_knn_graph_distance`).
+
+    Parameters
+    ----------
+    vertices : (B,) array_like
+        Indices of vertices for which to calculate surface distance
+    graph : array_like
+        Graph along which to calculate shortest path distances
+    n_neighbors : int, optional
+        Number of nearest neighbours of each vertex to keep. Default: None
+    cutoff : float, optional
+        Maximum distance of neighbours to keep. Default: None
+    coords : (N, 3) array_like, optional
+        Coordinates of all vertices in `graph`, used to bound the search for
+        nearest neighbours. Default: None
+    chunk_size : int, optional
+        Number of source vertices for which shortest paths are computed at
+        once. Default: 100
+
+    Returns
+    -------
+    row, col : (E,) numpy.ndarray
+        Indices of vertices and their neighbours
+    dist : (E,) numpy.ndarray
+        Distance of each vertex to each of its neighbours
+    """
+    vertices = np.asarray(vertices)
+    limit = np.inf if cutoff is None else cutoff
+    tree = None
+    if cutoff is None and n_neighbors is not None and coords is not None:
+        tree = cKDTree(coords)
+    blocks = []
+    for n in range(0, len(vertices), chunk_size):
+        chunk = vertices[n:n + chunk_size]
+        if tree is not None:
+            dist = _get_knn_graph_distance(chunk, graph, n_neighbors, tree)
+        else:
+            dist = sparse.csgraph.dijkstra(graph, directed=False,
+                                           indices=chunk, limit=limit)
+        blocks.append(_block_neighbors(dist, chunk, n_neighbors, cutoff))
+    return tuple(map(np.concatenate, zip(*blocks)))
+
+
+def _get_knn_graph_distance(vertices, graph, n_neighbors, tree, factor=2,
+                            n_retry=4):
+    """
+    Get surface distance of `vertices` to (at least) their nearest neighbours.
+
+    Shortest paths along the surface are never shorter than straight lines,
+    so shortest paths are first traced up to `factor` times the largest
+    Euclidean distance of any of `vertices` to its `n_neighbors`-th nearest
+    neighbour. Vertices with fewer than `n_neighbors` neighbours within that
+    distance are retried with twice the distance, and without any limit after
+    `n_retry` attempts. Distances to the `n_neighbors` nearest neighbours of
+    every vertex are thus exact.
+
+    Parameters
+    ----------
+    vertices : (B,) array_like
+        Indices of vertices for which to calculate surface distance
+    graph : array_like
+        Graph along which to calculate shortest path distances
+    n_neighbors : int
+        Number of nearest neighbours of each vertex to find
+    tree : scipy.spatial.cKDTree
+        Tree built on the coordinates of all vertices in `graph`
+    factor : float, optional
+        Initial search radius, relative to Euclidean neighbour distances.
+        Default: 2
+    n_retry : int, optional
+        Number of times the search radius is doubled before searching without
+        limit. Default: 4
+
+    Returns
+    -------
+    dist : (B, N) numpy.ndarray
+        Shortest path distances of `vertices` to all vertices in `graph`, with
+        inf for vertices beyond the final search radius
+    """
+    vertices = np.asarray(vertices)
+    k = min(n_neighbors + 1, graph.shape[0])  # includes the vertex itself
+    euclid, _ = tree.query(tree.data[vertices], k=k)
+    limit = factor * np.max(euclid[:, -1])
+
+    dist = np.full((len(vertices), graph.shape[0]), np.inf)
+    todo = np.arange(len(vertices))
+    for attempt in range(n_retry + 1):
+        if attempt == n_retry:
+            limit = np.inf
+        dist[todo] = sparse.csgraph.dijkstra(graph, directed=False,
+                                             indices=vertices[todo],
+                                             limit=limit)
+        todo = todo[np.sum(np.isfinite(dist[todo]), axis=1) < k]
+        if len(todo) == 0:
+            break
+        limit *= 2
+
+    return dist
+
+
+def _block_neighbors(block, rows, n_neighbors=None, cutoff=None):
+    """
+    Find neighbours of `rows` in a block of a dense distance matrix.
+
+    Parameters
+    ----------
+    block : (B, N) array_like
+        Rows of distance matrix
+    rows : (B,) array_like
+        Indices of rows in `block`
+    n_neighbors : int, optional
+        Number of nearest neighbours of each row to keep. Default: None
+    cutoff : float, optional
+        Maximum distance of neighbours to keep. Default: None
+
+    Returns
+    -------
+    row, col : (E,) numpy.ndarray
+        Indices of rows and their neighbours
+    dist : (E,) numpy.ndarray
+        Distance of each row to each of its neighbours
+    """
+    block = np.array(block, dtype='float64')
+    rows = np.asarray(rows)
+    block[np.arange(len(rows)), rows] = np.inf
+    if cutoff is not None:
+        block[block > cutoff] = np.inf
+    if n_neighbors is not None and n_neighbors < block.shape[1]:
+        col = np.argpartition(block, n_neighbors - 1, axis=1)
+        col = col[:, :n_neighbors]
+    else:
+        col = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+    dist = np.take_along_axis(block, col, axis=1)
+    row = np.broadcast_to(rows[:, None], col.shape)
+    keep = np.isfinite(dist)
+
+    return row[keep], col[keep], dist[keep]
+
+
+def sparsify_distance(dist, n_neighbors=None, cutoff=None, chunk_size=100):
+    """
+    Convert `dist` to a sparse matrix of distances between neighbours.
+
+    Only the distances from every vertex to its `n_neighbors` nearest
+    neighbours that are no further than `cutoff` are kept. The resulting
+    neighbourhoods are symmetrized (i.e., two vertices are neighbours if
+    either is a neighbour of the other) and self-distances are dropped.
+
+    Parameters
+    ----------
+    dist : (N, N) array_like or scipy.sparse matrix
+        Distance matrix. Dense arrays (including `np.memmap`) are read in
+        chunks of rows. For sparse matrices only stored entries are
+        considered to be neighbours.
+    n_neighbors : int, optional
+        Number of nearest neighbours of each vertex to keep. Default: None
+    cutoff : float, optional
+        Maximum distance between neighbours. Default: None
+    chunk_size : int, optional
+        Number of rows of a dense `dist` processed at once. Default: 100
+
+    Returns
+    -------
+    dist : (N, N) scipy.sparse.csr_matrix
+        Sparse distance matrix, with one stored entry for every pair of
+        neighbours
+
+    Raises
+    ------
+    ValueError
+        If neither `n_neighbors` nor `cutoff` is provided
+    """
+    if n_neighbors is None and cutoff is None:
+        raise ValueError('Must provide at least one of `n_neighbors` or '
+                         '`cutoff`.')
+
+    n_vert = dist.shape[0]
+    if sparse.issparse(dist):
+        dist = sparse.coo_matrix(dist)
+        row, col, val = dist.row, dist.col, dist.data.astype('float64')
+    else:
+        blocks = [
+            _block_neighbors(dist[start:start + chunk_size],
+                             np.arange(start, min(start + chunk_size, n_vert)),
+                             n_neighbors=n_neighbors, cutoff=cutoff)
+            for start in range(0, n_vert, chunk_size)
+        ]
+        row, col, val = map(np.concatenate, zip(*blocks))
+
+    return _sparse_neighbors(row, col, val, n_vert, n_neighbors, cutoff)
+
+
+class CondensedDistance():
+    """
+    Symmetric distance matrix stored on disk as tiles of its upper triangle.
+
+    The rows and columns of the matrix are split into blocks of `block_size`,
+    and only the (square) tiles on or above the diagonal are stored, each of
+    them contiguously. This roughly halves the size of the matrix (or quarters
+    it with `dtype` 'float16'). Rows are read from the memory-mapped file one
+    block at a time (see :meth:`CondensedDistance.block`), for which every
+    tile is read contiguously. The `n_neighbors` nearest neighbours of every
+    row are stored alongside.
+
+    Parameters
+    ----------
+    fname : str or os.PathLike
+        Directory in which the distance matrix is stored (see
+        :meth:`CondensedDistance.create`)
+
+    Attributes
+    ----------
+    shape : tuple-of-int
+        Shape of the (full) distance matrix
+    block_size : int
+        Number of rows per block
+    n_blocks : int
+        Number of blocks of rows
+    """
+
+    def __init__(self, fname):
+        self.fname = os.fspath(fname)
+        with open(os.path.join(self.fname, 'info.json')) as src:
+            info = json.load(src)
+        n_rows, self.block_size = info['n_rows'], info['block_size']
+        self.shape = (n_rows, n_rows)
+        self._data = np.load(os.path.join(self.fname, 'distance.npy'),
+                             mmap_mode='r')
+        self._starts = np.arange(0, n_rows, self.block_size)
+        self._ends = np.append(self._starts[1:], n_rows)
+        self.n_blocks = len(self._starts)
+        sizes = (self._ends - self._starts) * (n_rows - self._starts)
+        self._offsets = np.append(0, np.cumsum(sizes))
+
+    @classmethod
+    def create(cls, fname, distance, n_rows, dtype='float32',
+               block_size=256, n_neighbors=1000):
+        """
+        Compute distance matrix block by block and store it in `fname`.
+
+        Parameters
+        ----------
+        fname : str or os.PathLike
+            Directory in which to store distance matrix; created if it does
+            not exist
+        distance : callable or (N, N) array_like
+            Function that, given an array of row indices, returns the
+            corresponding (dense) rows of the distance matrix, or the full
+            distance matrix
+        n_rows : int
+            Number of rows (N) of the distance matrix
+        dtype : {'float32', 'float16'}, optional
+            Data type with which distances are stored. Default: 'float32'
+        block_size : int, optional
+            Number of rows per block. Default: 256
+        n_neighbors : int, optional
+            Number of nearest neighbours (in addition to the row itself) to
+            store for every row. Default: 1000
+
+        Returns
+        -------
+        dist : CondensedDistance
+            Stored distance matrix
+        """
+        if dtype not in ('float32', 'float16'):
+            raise ValueError('Provided dtype must be one of [\'float32\', '
+                             f'\'float16\'], not {dtype}')
+        if not callable(distance):
+            distance = partial(np.take, distance, axis=0)
+
+        os.makedirs(fname, exist_ok=True)
+        n_neighbors = min(n_neighbors + 1, n_rows)
+        starts = np.arange(0, n_rows, block_size)
+        ends = np.append(starts[1:], n_rows)
+        size = int(np.sum((ends - starts) * (n_rows - starts)))
+        data = np.lib.format.open_memmap(os.path.join(fname, 'distance.npy'),
+                                         mode='w+', dtype=dtype,
+                                         shape=(size,))
+        knn_dist = np.lib.format.open_memmap(
+            os.path.join(fname, 'knn_distance.npy'), mode='w+',
+            dtype='float32', shape=(n_rows, n_neighbors)
+        )
+        knn_index = np.lib.format.open_memmap(
+            os.path.join(fname, 'knn_index.npy'), mode='w+', dtype='int32',
+            shape=(n_rows, n_neighbors)
+        )
+
+        offset = 0
+        for n, (start, end) in enumerate(zip(starts, ends)):
+            rows = np.asarray(distance(np.arange(start, end)),
+                              dtype='float32')
+            for tstart, tend in zip(starts[n:], ends[n:]):
+                tile = rows[:, tstart:tend]
+                data[offset:offset + tile.size] = tile.ravel()
+                offset += tile.size
+            # nearest neighbours, sorted by distance, the row itself first
+            rows[np.arange(end - start), np.arange(start, end)] = -np.inf
+            idx = np.argpartition(rows, n_neighbors - 1,
+                                  axis=1)[:, :n_neighbors]
+            order = np.argsort(np.take_along_axis(rows, idx, axis=1), axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+            knn_index[start:end] = idx
+            knn_dist[start:end] = np.take_along_axis(rows, idx, axis=1)
+            knn_dist[start:end, 0] = 0
+        for arr in (data, knn_dist, knn_index):
+            arr.flush()
+
+        with open(os.path.join(fname, 'info.json'), 'w') as dest:
+            json.dump(dict(n_rows=int(n_rows), block_size=int(block_size)),
+                      dest)
+
+        return cls(fname)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _tile(self, m, n):
+        """Return memory-mapped tile of row block `m` and column block `n`."""
+        n_rows = self._ends[m] - self._starts[m]
+        n_cols = self._ends[n] - self._starts[n]
+        offset = self._offsets[m] + n_rows * (self._starts[n]
+                                              - self._starts[m])
+        data = self._data[offset:offset + n_rows * n_cols]
+        return data.reshape(n_rows, n_cols)
+
+    def block(self, n):
+        """
+        Get dense rows of block `n` of the distance matrix.
+
+        Every stored tile in the rows (or, transposed, the columns) of the
+        block is read contiguously from disk.
+
+        Parameters
+        ----------
+        n : int
+            Index of block, from 0 to `n_blocks` - 1
+
+        Returns
+        -------
+        dist : (B, N) numpy.ndarray
+            Rows ``n * block_size`` to ``(n + 1) * block_size`` of the distance
+            matrix (as float32)
+        """
+        start, end = self._starts[n], self._ends[n]
+        out = np.empty((end - start, self.shape[1]), dtype='float32')
+        for m in range(self.n_blocks):
+            cols = slice(self._starts[m], self._ends[m])
+            out[:, cols] = self._tile(n, m) if m >= n else self._tile(m, n).T
+        return out
+
+    def __getitem__(self, rows):
+        """
+        Get dense `rows` of the distance matrix.
+
+        All rows in the block of every requested row are read from disk (see
+        :meth:`CondensedDistance.block`), so rows are best read block by
+        block.
+
+        Parameters
+        ----------
+        rows : int or slice or array_like
+            Indices of rows to read
+
+        Returns
+        -------
+        dist : (R, N) numpy.ndarray
+            Requested rows of the distance matrix (as float32)
+        """
+        squeeze = np.ndim(rows) == 0 and not isinstance(rows, slice)
+        rows = np.atleast_1d(np.arange(self.shape[0])[rows])
+        out = np.empty((len(rows), self.shape[1]), dtype='float32')
+        blocks = rows // self.block_size
+        for n in np.unique(blocks):
+            sel, = np.nonzero(blocks == n)
+            out[sel] = self.block(n)[rows[sel] - self._starts[n]]
+        return out[0] if squeeze else out
+
+    def toarray(self):
+        """
+        Load the full distance matrix into memory.
+
+        Returns
+        -------
+        dist : (N, N) numpy.ndarray
+            Distance matrix (as float32)
+        """
+        out = np.empty(self.shape, dtype='float32')
+        for m in range(self.n_blocks):
+            rows = slice(self._starts[m], self._ends[m])
+            for n in range(m, self.n_blocks):
+                cols = slice(self._starts[n], self._ends[n])
+                tile = self._tile(m, n)
+                out[rows, cols] = tile
+                out[cols, rows] = tile.T
+        return out
+
+    def knn(self, n_neighbors=None):
+        """
+        Get nearest neighbours of every row, sorted by distance.
+
+        Parameters
+        ----------
+        n_neighbors : int, optional
+            Number of nearest neighbours to return. If not specified all
+            stored neighbours are returned. Default: None
+
+        Returns
+        -------
+        dist : (N, K + 1) numpy.memmap
+            Distance of every row to itself (first column) and its `K`
+            nearest neighbours
+        index : (N, K + 1) numpy.memmap
+            Indices of every row (first column) and its nearest neighbours
+        """
+        dist = np.load(os.path.join(self.fname, 'knn_distance.npy'),
+                       mmap_mode='r')
+        index = np.load(os.path.join(self.fname, 'knn_index.npy'),
+                        mmap_mode='r')
+        if n_neighbors is not None:
+            if n_neighbors + 1 > dist.shape[1]:
+                raise ValueError(f'Only {dist.shape[1] - 1} nearest '
+                                 'neighbours are stored, cannot return '
+                                 f'{n_neighbors}')
+            dist, index = dist[:, :n_neighbors + 1], index[:, :n_neighbors + 1]
+        return dist, index
+
+
+def _sparse_neighbors(row, col, val, n_vert, n_neighbors=None, cutoff=None):
+    """
+    Construct symmetric sparse distance matrix from neighbour distances.
+
+    Parameters
+    ----------
+    row, col : (E,) array_like
+        Indices of vertices and their (candidate) neighbours
+    val : (E,) array_like
+        Distance between each vertex and each of its candidate neighbours
+    n_vert : int
+        Number of vertices
+    n_neighbors : int, optional
+        Number of nearest neighbours of each vertex to keep. Default: None
+    cutoff : float, optional
+        Maximum distance between neighbours. Default: None
+
+    Returns
+    -------
+    dist : (N, N) scipy.sparse.csr_matrix
+        Sparse distance matrix
+    """
+    keep = np.logical_and(row != col, np.isfinite(val))
+    if cutoff is not None:
+        keep = np.logical_and(keep, val <= cutoff)
+    row, col, val = row[keep], col[keep], val[keep]
+
+    if n_neighbors is not None:
+        order = np.lexsort((val, row))
+        row, col, val = row[order], col[order], val[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row)
+        keep = rank < n_neighbors
+        row, col, val = row[keep], col[keep], val[keep]
+
+    # keep each pair only once; explicit zero distances are retained
+    row, col = np.hstack((row, col)), np.hstack((col, row))
+    val = np.hstack((val, val))
+    _, idx = np.unique(row * n_vert + col, return_index=True)
+
+    return sparse.csr_matrix((val[idx], (row[idx], col[idx])),
+                             shape=(n_vert, n_vert))
 
 
 def get_surface_distance(surface, parcellation=None, medial=None,
-                         medial_labels=None, drop=None, n_proc=1):
+                         medial_labels=None, drop=None, n_proc=1,
+                         n_neighbors=None, cutoff=None, memmap=None,
+                         method='mean', n_landmarks=None, seed=None):
     """
     Calculate surface distance for vertices in `surface`.
 
@@ -325,8 +1006,7 @@ def get_surface_distance(surface, parcellation=None, medial=None,
     parcellation : str or os.PathLike, optional
         Path to file with parcel labels for provided `surface`. If provided
         will calculate parcel-parcel distances instead of vertex distances,
-        where parcel-parcel distance is the average distance between all
-        constituent vertices in two parcels. Default: None
+        where parcel-parcel distance is defined by `method`. Default: None
     medial : str or os.PathLike, optional
         Path to file indicating which vertices correspond to the medial wall
         (0 indicates medial wall). If provided will prohibit calculation of
@@ -346,12 +1026,62 @@ def get_surface_distance(surface, parcellation=None, medial=None,
         Number of processors to use for parallelizing distance calculation. If
         negative, will use max available processors plus 1 minus the specified
         number. Default: 1 (no parallelization)
+    n_neighbors : int, optional
+        If specified, only keep distances from every vertex to its
+        `n_neighbors` nearest neighbours and return a sparse matrix (see
+        :func:`sparsify_distance`). Unless `cutoff` is given, shortest paths
+        are traced from every vertex until its nearest neighbours are found,
+        starting at twice the Euclidean distance of its `n_neighbors`-th
+        nearest neighbour. Not available with `parcellation`. Default: None
+    cutoff : float, optional
+        If specified, only keep distances between vertices that are no
+        further than `cutoff` apart and return a sparse matrix. Shortest paths
+        are not traced beyond `cutoff`. Not available with `parcellation`.
+        Default: None
+    memmap : str or os.PathLike, optional
+        If specified, the (N, N) vertex distance matrix is written to this
+        `.npy` file and returned as a memory-mapped array, such that it need
+        not fit in memory. Not available with `n_neighbors` or `cutoff`.
+        Default: None
+    method : {'mean', 'centroid', 'min'}, optional
+        Definition of parcel-parcel distance if `parcellation` is provided.
+        'mean' averages the distance between all constituent vertices of two
+        parcels, which requires one shortest path tree per vertex. 'centroid'
+        uses the distance between the geodesic centroids of two parcels and
+        'min' the shortest distance between any of their vertices; both only
+        require one shortest path tree per parcel. Default: 'mean'
+    n_landmarks : int, optional
+        If specified, vertex distances are approximated using shortest paths
+        from `n_landmarks` landmark vertices spread across `surface`, which is
+        considerably faster than computing all exact shortest paths on
+        high-density meshes. Short distances remain exact; longer distances
+        are overestimated by the detour through nearby landmarks, which
+        decreases with more landmarks. Use :func:`surface_distance_error` to
+        check the accuracy. Not available with `parcellation`, `n_neighbors`
+        or `cutoff`. Default: None
+    seed : {int, np.random.Generator instance, None}, optional
+        Seed for selecting landmarks. Only used if `n_landmarks` is
+        specified. Default: None
 
     Returns
     -------
-    distance : (N, N) numpy.ndarray
+    distance : (N, N) numpy.ndarray or scipy.sparse.csr_matrix
         Surface distance between vertices/parcels on `surface`
     """
+    local = n_neighbors is not None or cutoff is not None
+    if local and parcellation is not None:
+        raise ValueError('Cannot compute sparse distance matrix when '
+                         '`parcellation` is provided.')
+    if local and memmap is not None:
+        raise ValueError('Cannot memory-map sparse distance matrix.')
+    if n_landmarks is not None and (local or parcellation is not None):
+        raise ValueError('Cannot approximate distances with landmarks when '
+                         '`parcellation`, `n_neighbors`, or `cutoff` is '
+                         'provided.')
+    if method not in ('mean', 'centroid', 'min'):
+        raise ValueError('Provided method must be one of [\'mean\', '
+                         f'\'centroid\', \'min\'], not {method}')
+
     if drop is None:
         drop = PARCIGNORE
 
@@ -374,23 +1104,149 @@ def get_surface_distance(surface, parcellation=None, medial=None,
 
     # calculate distance from each vertex to all other vertices
     graph = make_surf_graph(vert, faces, mask=mask)
-    dist = np.vstack(Parallel(n_jobs=n_proc, max_nbytes=None)(
-        delayed(_get_graph_distance)(n, graph, labels) for n in range(n_vert)
-    ))
-
-    # average distance for all vertices within a parcel + set diagonal to 0
-    if labels is not None:
-        dist = np.vstack([
-            dist[labels == lab].mean(axis=0) for lab in np.unique(labels)
+    n_proc = min(effective_n_jobs(n_proc), n_vert)
+    blocks = np.array_split(np.arange(n_vert), n_proc)
+    if local:
+        # only neighbourhoods are kept, so rows are never all held in memory;
+        # every worker receives the graph once and traces shortest paths for
+        # its block of vertices in chunks
+        blocks = Parallel(n_jobs=n_proc, max_nbytes=None)(
+            delayed(_get_sparse_graph_distance)(block, graph, n_neighbors,
+                                                cutoff, coords=vert)
+            for block in blocks
+        )
+        row, col, val = map(np.concatenate, zip(*blocks))
+        return _sparse_neighbors(row, col, val, n_vert, n_neighbors, cutoff)
+
+    # distances between parcel centroids / closest vertices of parcels, which
+    # only need one shortest path tree per parcel (the first, background,
+    # label is dropped)
+    if labels is not None and method == 'centroid':
+        roi = np.array([
+            _geodesic_parcel_centroid(vert, faces, np.flatnonzero(labels == p),
+                                      graph=graph, return_index=True)
+            for p in np.unique(labels)[1:]
         ])
+        return _get_graph_distance(roi, graph)[:, roi]
+    elif labels is not None and method == 'min':
+        parcels = np.array_split(np.unique(labels)[1:], n_proc)
+        dist = np.vstack(Parallel(n_jobs=n_proc, max_nbytes=None)(
+            delayed(_get_parcel_min_distance)(parc, graph, labels)
+            for parc in parcels
+        ))
+        return dist[:, 1:]
+
+    # average distance for all vertices within a parcel + set diagonal to 0;
+    # workers only return (parcel, parcel) sums of their source vertices
+    if labels is not None:
+        uniq, count = np.unique(labels, return_counts=True)
+        # rows of the first (background) label are dropped, so skip them
+        blocks = [block[labels[block] != uniq[0]] for block in blocks]
+        dist = sum(Parallel(n_jobs=n_proc, max_nbytes=None)(
+            delayed(_get_parcel_distance)(block, graph, labels)
+            for block in blocks
+        ))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = (dist / count[:, None]).astype('float32')
         dist[np.diag_indices_from(dist)] = 0
-        dist = dist[1:, 1:]
+        return dist[1:, 1:]
+
+    # rows are written into a preallocated float32 array; with multiple
+    # processes this array is memory-mapped so that workers can write to it,
+    # and every worker receives the graph once along with a contiguous block
+    # of source vertices
+    func = _get_graph_distance
+    if n_landmarks is not None:
+        # exact shortest paths from landmarks are used to approximate long
+        # distances; shortest paths are only traced up to a few times the
+        # largest distance of any vertex to its nearest landmark
+        landmarks = _get_landmarks(vert, graph, n_landmarks, seed=seed)
+        ldist = np.vstack(Parallel(n_jobs=n_proc, max_nbytes=None)(
+            delayed(_get_graph_distance)(lmk, graph)
+            for lmk in np.array_split(landmarks, n_proc)
+        ))
+        radius = ldist.min(axis=0)
+        limit = 3 * radius[np.isfinite(radius)].max()
+        func = partial(_get_landmark_distance, ldist=ldist, limit=limit)
+
+    fname, tempdir = memmap, None
+    if fname is None and n_proc > 1:
+        tempdir = tempfile.mkdtemp()
+        fname = os.path.join(tempdir, 'dist.npy')
+
+    try:
+        if fname is not None:
+            dist = np.lib.format.open_memmap(fname, mode='w+',
+                                             dtype='float32',
+                                             shape=(n_vert, n_vert))
+        else:
+            dist = np.empty((n_vert, n_vert), dtype='float32')
+        Parallel(n_jobs=n_proc, max_nbytes=None)(
+            delayed(func)(block, graph, out=dist) for block in blocks
+        )
+        if tempdir is not None:
+            dist = np.array(dist)
+        elif fname is not None:
+            dist.flush()
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir, ignore_errors=True)
 
-    # remove distances for parcels that we aren't interested in
     return dist
 
 
-def _geodesic_parcel_centroid(vertices, faces, inds):
+def surface_distance_error(surface, distance, medial=None, n_sample=100,
+                           seed=None):
+    """
+    Estimate error of vertex distances in `distance` on `surface`.
+
+    Exact surface distances are calculated for a random sample of vertices and
+    compared to their rows of `distance`, e.g., to assess the accuracy of
+    distances approximated by :func:`get_surface_distance`.
+
+    Parameters
+    ----------
+    surface : str or os.PathLike
+        Path to surface file on which `distance` was calculated
+    distance : (N, N) array_like
+        Vertex distance matrix of `surface`
+    medial : str or os.PathLike, optional
+        Path to file indicating which vertices correspond to the medial wall
+        (0 indicates medial wall), as used to calculate `distance`. Default:
+        None
+    n_sample : int, optional
+        Number of vertices for which to calculate exact distances. Default:
+        100
+    seed : {int, np.random.Generator instance, None}, optional
+        Seed for selecting vertices. Default: None
+
+    Returns
+    -------
+    mean_error : float
+        Mean relative error of distances in `distance`
+    max_error : float
+        Maximum relative error of distances in `distance`
+    """
+    rs = np.random.default_rng(seed)
+    vert, faces = load_gifti(surface).agg_data()
+    mask = None
+    if medial is not None:
+        mask = np.logical_not(load_gifti(medial).agg_data().astype(bool))
+    graph = make_surf_graph(vert, faces, mask=mask)
+
+    candidates = np.flatnonzero(graph.getnnz(axis=0) + graph.getnnz(axis=1))
+    sample = np.sort(rs.choice(candidates, min(n_sample, len(candidates)),
+                               replace=False))
+    exact = _get_graph_distance(sample, graph)
+    approx = np.asarray(distance[sample], dtype='float32')
+    keep = np.logical_and(np.isfinite(exact), exact > 0)
+    error = np.abs(approx[keep] - exact[keep]) / exact[keep]
+
+    return float(error.mean()), float(error.max())
+
+
+def _geodesic_parcel_centroid(vertices, faces, inds, graph=None,
+                              return_index=False):
     """
     Calculate parcel centroids based on surface distance.
 
@@ -402,19 +1258,30 @@ def _geodesic_parcel_centroid(vertices, faces, inds):
         Triangular faces defining surface
     inds : (R,)
         Indices of `vertices` that belong to parcel
+    graph : scipy.sparse.csr_matrix, optional
+        Graph of `vertices` and `faces` (see :func:`make_surf_graph`). If
+        provided shortest paths are computed on the subgraph of `inds` instead
+        of constructing a new graph. Default: None
+    return_index : bool, optional
+        Whether to return the index of the centroid vertex instead of its
+        coordinates. Default: False
 
     Returns
     -------
-    roi : (3,) numpy.ndarray
-        Vertex corresponding to centroid of parcel
+    roi : (3,) numpy.ndarray or int
+        Vertex (or index of vertex) corresponding to centroid of parcel
     """
-    mask = np.ones(len(vertices), dtype=bool)
-    mask[inds] = False
-    mat = make_surf_graph(vertices, faces, mask=mask)
-    paths = sparse.csgraph.dijkstra(mat, directed=False, indices=inds)[:, inds]
+    if graph is None:
+        mask = np.ones(len(vertices), dtype=bool)
+        mask[inds] = False
+        mat = make_surf_graph(vertices, faces, mask=mask)
+        paths = sparse.csgraph.dijkstra(mat, directed=False,
+                                        indices=inds)[:, inds]
+    else:
+        paths = sparse.csgraph.dijkstra(graph[inds][:, inds], directed=False)
 
     # the selected vertex is the one with the minimum average shortest path
     # to the other vertices in the parcel
-    roi = vertices[inds[paths.mean(axis=1).argmin()]]
+    roi = inds[paths.mean(axis=1).argmin()]
 
-    return roi
+    return roi if return_index else vertices[roi]
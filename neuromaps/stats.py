@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 """Functions for statistical analyses."""
 
-from functools import partial
+from collections.abc import Iterator
+from functools import partial, wraps
+from itertools import islice
+import os
 
+from joblib import Parallel, delayed, effective_n_jobs
 import numpy as np
 from scipy import special, stats as sstats
 try:
@@ -13,9 +17,13 @@ from sklearn.utils.validation import check_random_state
 
 from neuromaps.images import load_data
 
+# upper bound on the size of each chunk of null maps scored at once
+_MAX_CHUNK_BYTES = 2 ** 27
+
 
 def compare_images(src, trg, metric='pearsonr', ignore_zero=True, nulls=None,
-                   nan_policy='omit', return_nulls=False):
+                   nan_policy='omit', return_nulls=False, max_memory=None,
+                   n_exceed=None, n_proc=1, dtype='float64'):
     """
     Compare images `src` and `trg`.
 
@@ -30,13 +38,20 @@ def compare_images(src, trg, metric='pearsonr', ignore_zero=True, nulls=None,
     metric : {'pearsonr', 'spearmanr', callable}, optional
         Type of similarity metric to use to compare `src` and `trg` images. If
         a callable function is provided it must accept two inputs and return a
-        single value (the similarity metric). Default: 'pearsonr'
+        single value (the similarity metric), unless it is marked as batched
+        with :func:`batched_metric`. Default: 'pearsonr'
     ignore_zero : bool, optional
         Whether to perform comparisons ignoring all zero values in `src` and
         `trg` data. Default: True
-    nulls : array_like, optional
+    nulls : array_like or str or os.PathLike or iterator, optional
         Null data for `src` to use in generating a non-parametric p-value.
-        If not specified a parametric p-value is generated. Default: None
+        Can be an array (including `np.memmap`) or a filepath to a `.npy` file,
+        which will be memory-mapped. Null maps are read, masked, and scored in
+        chunks so the full null array is never copied into memory. Can also be
+        an iterator (e.g., a generator) yielding (N,) null maps or (N, C)
+        chunks of null maps, which are consumed lazily. If `metric` is
+        'spearmanr' every null map is ranked prior to comparison. If not
+        specified a parametric p-value is generated. Default: None
     nan_policy : {'propagate', 'raise', 'omit'}, optional
         Defines how to handle when input contains nan. 'propagate' propagates
         the nan values to the callable metric (will return nan if the metric
@@ -45,6 +60,20 @@ def compare_images(src, trg, metric='pearsonr', ignore_zero=True, nulls=None,
     return_nulls : bool, optional
         Whether to return the null distribution of comparisons. Can only be set
         to `True` if `nulls` is not None. Default: False
+    max_memory : int, optional
+        Approximate upper bound (in bytes) on the memory used by each chunk of
+        `nulls` while it is being scored. If not specified a chunk will use at
+        most 128 MiB. Default: None
+    n_exceed : int, optional
+        If specified, stop scoring `nulls` as soon as this many null
+        comparisons are at least as extreme as `similarity` (see
+        :func:`permtest_metric`). Default: None
+    n_proc : int, optional
+        Number of processes used to score `nulls` when `metric` is a callable.
+        Default: 1 (no parallelization)
+    dtype : {'float64', 'float32'}, optional
+        Floating point type in which images and null maps are loaded and
+        compared (see :func:`permtest_metric`). Default: 'float64'
 
     Returns
     -------
@@ -55,20 +84,18 @@ def compare_images(src, trg, metric='pearsonr', ignore_zero=True, nulls=None,
     nulls : (n_perm, ) array_like
         Null distribution of similarity metrics. Only returned if
         `return_nulls` is True.
+    n_used : int
+        Number of null maps scored before stopping. Only returned if `nulls`
+        and `n_exceed` are not None.
     """
     methods = ('pearsonr', 'spearmanr')
-    if metric not in methods:
-        if not callable(metric):
-            raise ValueError(f'Invalid `metric`: {metric}')
-        else:
-            if not np.isscalar(metric([1, 1], [1, 1])):
-                raise ValueError('Provided callable `metric` must accept two '
-                                 'inputs and return single value.')
+    _check_metric(metric)
 
     if return_nulls and nulls is None:
         raise ValueError('`return_nulls` cannot be True when `nulls` is None.')
 
-    srcdata, trgdata = load_data(src), load_data(trg)
+    srcdata = load_data(src, dtype=dtype)
+    trgdata = load_data(trg, dtype=dtype)
 
     # drop NaNs (if nan_policy==`omit`) and zeros (if ignore_zero=True)
     zeromask = np.zeros(len(srcdata), dtype=bool)
@@ -86,24 +113,208 @@ def compare_images(src, trg, metric='pearsonr', ignore_zero=True, nulls=None,
         mask = np.logical_not(zeromask)
     srcdata, trgdata = srcdata[mask], trgdata[mask]
 
+    if nulls is not None:
+        nulls = _load_nulls(nulls)
+        return _permtest_metric(srcdata, trgdata, metric, nulls=nulls,
+                                nan_policy=nan_policy,
+                                return_nulls=return_nulls,
+                                max_memory=max_memory, n_exceed=n_exceed,
+                                n_proc=n_proc, dtype=dtype, null_mask=mask)
+
     if metric in methods:
         if metric == 'spearmanr':
-            srcdata = sstats.rankdata(srcdata)
-            trgdata = sstats.rankdata(trgdata)
+            srcdata = _rankdata_cols(srcdata)
+            trgdata = _rankdata_cols(trgdata)
         metric = partial(efficient_pearsonr, return_pval=False)
+    elif getattr(metric, 'batched', False):
+        return metric(srcdata[:, None], trgdata)[0]
+
+    return metric(srcdata, trgdata)
+
+
+def compare_images_matrix(src, trg=None, metric='pearsonr', ignore_zero=True,
+                          nulls=None, nan_policy='omit', return_nulls=False,
+                          max_memory=None, n_proc=1, dtype='float64'):
+    """
+    Compare every image in `src` with every image in `trg`.
+
+    Equivalent to calling :func:`compare_images` on every pair of images from
+    `src` and `trg`, except that data are loaded only once and all pairs are
+    compared simultaneously with blocked matrix products. Zero / NaN masks are
+    still determined separately for every pair of images.
+
+    Parameters
+    ----------
+    src : list or array_like
+        Source images. Can be a list where each entry is any single input
+        accepted by :func:`compare_images` (e.g., a tuple of (left, right)
+        hemisphere images), or an (N, K) array where each column is a map
+    trg : list or array_like, optional
+        Target images, in the same format as `src`. If not specified then all
+        images in `src` are compared with each other. Default: None
+    metric : {'pearsonr', 'spearmanr', callable}, optional
+        Type of similarity metric to use to compare images. If a callable
+        function is provided it must accept two inputs and return a single
+        value (the similarity metric); note that callable metrics are
+        evaluated separately for every pair of images. Default: 'pearsonr'
+    ignore_zero : bool, optional
+        Whether to perform comparisons ignoring all zero values in `src` and
+        `trg` data. Default: True
+    nulls : list of array_like or str or os.PathLike, optional
+        Null data for each image in `src` to use in generating non-parametric
+        p-values. Must have one entry per image in `src`, where every entry
+        has the same number of null maps and is in a format accepted by
+        :func:`compare_images`. If `src` contains only one image a single
+        array may be provided. If not specified only similarities are
+        returned. Default: None
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Defines how to handle when input contains nan. 'propagate' propagates
+        the nan values to the callable metric (will return nan if the metric
+        is `spearmanr` `or pearsonr`), 'raise' throws an error, 'omit' performs
+        the calculations ignoring nan values. Default: 'omit'
+    return_nulls : bool, optional
+        Whether to return the null distribution of comparisons. Can only be set
+        to `True` if `nulls` is not None. Default: False
+    max_memory : int, optional
+        Approximate upper bound (in bytes) on the memory used by each chunk of
+        `nulls` while it is being scored. If not specified a chunk will use at
+        most 128 MiB. Default: None
+    n_proc : int, optional
+        Number of processes used to score `nulls` when `metric` is a callable.
+        Default: 1 (no parallelization)
+    dtype : {'float64', 'float32'}, optional
+        Floating point type in which images and null maps are loaded and
+        compared (see :func:`permtest_metric`). Default: 'float64'
+
+    Returns
+    -------
+    similarity : (K, M) numpy.ndarray
+        Comparison metric between every image in `src` and `trg`
+    pvalue : (K, M) numpy.ndarray
+        The p-values of `similarity`, if `nulls` is not None
+    nulls : (K, M, n_perm) numpy.ndarray
+        Null distribution of similarity metrics. Only returned if
+        `return_nulls` is True.
+    """
+    methods = ('pearsonr', 'spearmanr')
+    _check_metric(metric)
 
+    if return_nulls and nulls is None:
+        raise ValueError('`return_nulls` cannot be True when `nulls` is None.')
+
+    srcdata = _load_maps(src, dtype=dtype)
+    trgdata = srcdata if trg is None else _load_maps(trg, dtype=dtype)
+    if len(srcdata) != len(trgdata):
+        raise ValueError('Provided `src` and `trg` images have different '
+                         'numbers of observations.')
+    srcmask = _get_map_mask(srcdata, ignore_zero, nan_policy)
+    trgmask = _get_map_mask(trgdata, ignore_zero, nan_policy)
+    n_src, n_trg = srcdata.shape[-1], trgdata.shape[-1]
+
+    n_perm = 0
     if nulls is not None:
-        n_perm = nulls.shape[-1]
-        nulls = nulls[mask]
-        return permtest_metric(srcdata, trgdata, metric, n_perm=n_perm,
-                               nulls=nulls, nan_policy=nan_policy,
-                               return_nulls=return_nulls)
+        if (isinstance(nulls, (str, os.PathLike))
+                or (isinstance(nulls, np.ndarray) and n_src == 1)):
+            nulls = [nulls]
+        if len(nulls) != n_src:
+            raise ValueError('Must provide one set of `nulls` for each image '
+                             f'in `src`. Expected {n_src}, got {len(nulls)}.')
+        nulls = [_load_nulls(null) for null in nulls]
+        nulls = [null.reshape(-1, null.shape[-1]) for null in nulls]
+        n_perm = nulls[0].shape[-1]
+        if any(null.shape[-1] != n_perm for null in nulls):
+            raise ValueError('All provided `nulls` must contain the same '
+                             'number of null maps.')
 
-    return metric(srcdata, trgdata)
+    similarity = np.full((n_src, n_trg), np.nan)
+    permutations = np.ones((n_src, n_trg))
+    nulldist = None
+    if return_nulls:
+        nulldist = np.zeros((n_src, n_trg, n_perm), dtype=dtype)
+
+    # ranks can only be shared between pairs if all pairs have the same mask
+    shared = (np.all(srcmask == srcmask[:, [0]])
+              and np.all(trgmask == srcmask[:, [0]]))
+    if metric == 'pearsonr' or (metric == 'spearmanr' and shared):
+        if metric == 'spearmanr':
+            srcdata = _rankdata_cols(np.where(srcmask, srcdata, np.nan))
+            trgdata = _rankdata_cols(np.where(trgmask, trgdata, np.nan))
+        similarity = _pairwise_pearsonr(srcdata, srcmask, trgdata, trgmask,
+                                        nan_policy=nan_policy)
+        for k in range(n_src if nulls is not None else 0):
+            itemsize = max(nulls[k].itemsize, np.dtype(dtype).itemsize)
+            chunk_size = _get_chunk_size(len(nulls[k]), n_perm,
+                                         itemsize=itemsize,
+                                         max_memory=max_memory)
+            for start, chunk in _null_chunks(None, nulls[k], n_perm, None,
+                                             chunk_size, dtype=dtype):
+                chunkmask = np.broadcast_to(srcmask[:, [k]], chunk.shape)
+                if metric == 'spearmanr':
+                    chunk = _rankdata_cols(np.where(chunkmask, chunk, np.nan))
+                nullcomp = _pairwise_pearsonr(chunk, chunkmask,
+                                              trgdata, trgmask,
+                                              nan_policy=nan_policy)
+                permutations[k] += np.sum(
+                    np.abs(nullcomp) >= np.abs(similarity[k]), axis=0
+                )
+                if return_nulls:
+                    nulldist[k, :, start:start + len(nullcomp)] = nullcomp.T
+    else:
+        # masks (and thus ranks) differ between pairs, or we have an arbitrary
+        # callable that cannot be vectorized: compare one pair at a time
+        chunk_dtype = dtype if metric in methods else None
+        for k in range(n_src):
+            if nulls is None:
+                for m in range(n_trg):
+                    mask = np.logical_and(srcmask[:, k], trgmask[:, m])
+                    a, b = srcdata[mask, k], trgdata[mask, m]
+                    func = metric
+                    if metric in methods:
+                        a, b = _rankdata_cols(a), _rankdata_cols(b)
+                        func = partial(efficient_pearsonr, return_pval=False)
+                    elif getattr(metric, 'batched', False):
+                        a = a[:, None]
+                    similarity[k, m] = np.squeeze(func(a, b))
+                continue
+            # every chunk of null maps is read once and scored against all
+            # targets, keeping only the chunk's null comparisons in memory
+            chunk_size = _get_chunk_size(len(nulls[k]), n_perm,
+                                         itemsize=nulls[k].itemsize,
+                                         max_memory=max_memory)
+            for start, chunk in _null_chunks(None, nulls[k], n_perm, None,
+                                             chunk_size, dtype=chunk_dtype):
+                for m in range(n_trg):
+                    mask = np.logical_and(srcmask[:, k], trgmask[:, m])
+                    if not np.any(mask):
+                        continue
+                    sim, _, nullcomp = _permtest_metric(
+                        srcdata[mask, k], trgdata[mask, m], metric,
+                        nulls=chunk[mask], nan_policy=nan_policy,
+                        return_nulls=True, max_memory=max_memory,
+                        n_proc=n_proc, dtype=dtype
+                    )
+                    similarity[k, m] = sim
+                    permutations[k, m] += np.sum(np.abs(nullcomp)
+                                                 >= np.abs(sim))
+                    if return_nulls:
+                        nulldist[k, m, start:start + len(nullcomp)] = nullcomp
+
+    if nulls is None:
+        return similarity
+
+    pvals = permutations / (n_perm + 1)  # + 1 in denom accounts for true_sim
+    pvals[np.isnan(similarity)] = np.nan
+
+    if return_nulls:
+        return similarity, pvals, nulldist
+
+    return similarity, pvals
 
 
 def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
-                    nan_policy='propagate', return_nulls=False):
+                    nan_policy='propagate', return_nulls=False,
+                    max_memory=None, n_exceed=None, n_proc=1,
+                    dtype='float64'):
     """
     Generate non-parameteric p-value of `a` and `b` for `metric`.
 
@@ -117,7 +328,8 @@ def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
     metric : {'pearsonr', 'spearmanr', callable}, optional
         Type of similarity metric to use to compare `a` and `b`. If a callable
         function is provided it must accept two inputs and return a single
-        value (the similarity metric). Default: 'pearsonr'
+        value (the similarity metric), unless it is marked as batched with
+        :func:`batched_metric`. Default: 'pearsonr'
     n_perm : int, optional
         Number of permutations to assess. Unless `a` and `b` are very small
         this will approximate a randomization test via Monte Carlo simulations.
@@ -125,18 +337,43 @@ def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
     seed : {int, np.random.RandomState instance, None}, optional
         Seed for random number generation. Set to None for pseudo-randomness.
         Default: 0
-    nulls : (N, P) array_like, optional
+    nulls : (N, P) array_like or str or os.PathLike or iterator, optional
         Null array used in place of shuffled `a` array to compute null
         distribution of correlations. Array must have the same length as `a`
         and `b`. Providing this will override the value supplied to `n_perm`.
-        When not specified a standard permutation is used to shuffle `a`.
-        Default: None
+        Can be a filepath to a `.npy` file, which will be memory-mapped and
+        read in chunks, or an iterator (e.g., a generator) yielding (N,) null
+        maps or (N, C) chunks of null maps, which are consumed lazily such
+        that null generation and scoring are interleaved. If `metric` is
+        'spearmanr' every null map is ranked prior to comparison. When not
+        specified a standard permutation is used to shuffle `a`. Default: None
     nan_policy : {'propagate', 'raise', 'omit'}, optional
         Defines how to handle when inputs contain nan. 'propagate' returns nan,
         'raise' throws an error, 'omit' performs the calculations ignoring nan
         values. Default: 'propagate'
     return_nulls : bool, optional
         Whether to return the null distribution of comparisons. Default: False
+    max_memory : int, optional
+        Approximate upper bound (in bytes) on the memory used by each chunk of
+        null maps while it is being scored. If not specified a chunk will use
+        at most 128 MiB. Default: None
+    n_exceed : int, optional
+        If specified, use sequential Monte Carlo testing ([PT1]_) and stop
+        generating and scoring null maps as soon as this many of them are at
+        least as extreme as `similarity`. Values between 10 and 20 are
+        typical. Default: None
+    n_proc : int, optional
+        Number of processes across which chunks of null maps are distributed
+        when `metric` is a callable. Results are identical for any value of
+        `n_proc`. If negative will use max available processors plus 1 minus
+        the specified number. Default: 1 (no parallelization)
+    dtype : {'float64', 'float32'}, optional
+        Floating point type in which `a`, `b`, and null maps are compared and
+        null comparisons are stored when `metric` is 'pearsonr' or
+        'spearmanr'. Using 'float32' halves the memory and bandwidth needed to
+        score null maps; means and variances are always accumulated in double
+        precision. Callable metrics receive inputs unchanged. Default:
+        'float64'
 
     Returns
     -------
@@ -146,12 +383,53 @@ def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
         Non-parametric p-value
     nulls : (n_perm, ) array_like
         Null distribution of similarity metrics. Only returned if
-        `return_nulls` is True.
+        `return_nulls` is True. If `n_exceed` is specified this only contains
+        the null maps that were scored.
+    n_used : int or numpy.ndarray
+        Number of null maps scored before stopping. Only returned if
+        `n_exceed` is not None.
 
     Notes
     -----
     The lowest p-value that can be returned by this function is equal to 1 /
     (`n_perm` + 1).
+
+    If `n_exceed` is specified and `n_exceed` null comparisons are found to be
+    at least as extreme as `similarity` after `n_used` null maps, the p-value
+    is `n_exceed` / `n_used` ([PT1]_). Otherwise, all `n_perm` null maps are
+    scored and the p-value is computed as usual.
+
+    References
+    ----------
+    .. [PT1] Besag, J., & Clifford, P. (1991). Sequential Monte Carlo
+       p-values. Biometrika, 78(2), 301-304.
+    """
+    if nulls is not None:
+        nulls = _load_nulls(nulls)
+
+    return _permtest_metric(a, b, metric, n_perm=n_perm, seed=seed,
+                            nulls=nulls, nan_policy=nan_policy,
+                            return_nulls=return_nulls, max_memory=max_memory,
+                            n_exceed=n_exceed, n_proc=n_proc, dtype=dtype)
+
+
+def _permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
+                     nan_policy='propagate', return_nulls=False,
+                     max_memory=None, n_exceed=None, n_proc=1,
+                     dtype='float64', null_mask=None):
+    """
+    Run permutation test of `a` and `b` for `metric`.
+
+    See :func:`permtest_metric` for details on all parameters other than
+    `null_mask`.
+
+    Parameters
+    ----------
+    null_mask : array_like of bool, optional
+        Boolean mask applied to each chunk of `nulls` after it is read, such
+        that `nulls` has shape ``null_mask.shape + (P,)`` and `a` has length
+        ``null_mask.sum()``. Avoids copying all of `nulls` when only a subset
+        of observations is needed. Default: None
     """
 
     def nan_wrap(a, b, nan_policy='propagate'):
@@ -176,27 +454,105 @@ def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
     if metric in methods:
         if metric == 'spearmanr':
             a, b = sstats.rankdata(a), sstats.rankdata(b)
+        a, b = a.astype(dtype, copy=False), b.astype(dtype, copy=False)
         compfunc = partial(efficient_pearsonr, return_pval=False)
     else:
         compfunc = nan_wrap
+        dtype = None
 
-    if nulls is not None:
+    streamed = isinstance(nulls, Iterator)
+    if nulls is not None and not streamed:
         n_perm = nulls.shape[-1]
 
+    # null maps need to be ranked if they were not generated by shuffling `a`
+    rank_nulls = metric == 'spearmanr' and nulls is not None
+
+    # when a single map is correlated with `b` we can standardize `b` once and
+    # score entire blocks of null maps with a single matrix product. the same
+    # goes for callables that can score blocks of null maps themselves
+    if metric in methods:
+        batched = a.ndim == 1
+    else:
+        batched = getattr(metric, 'batched', False) and a.ndim == b.ndim == 1
+    if batched and metric in methods:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bz = _zscore(b, ddof=1)
+        compfunc = partial(_pearsonr_chunk, bz=bz)
+    elif batched:
+        compfunc = partial(_metric_chunk, metric=metric)
+
     # divide by one forces coercion to float if ndim = 0
-    true_sim = compfunc(a, b, nan_policy=nan_policy) / 1
+    if batched:
+        true_sim = compfunc(a, b, nan_policy=nan_policy)[0] / 1
+    else:
+        true_sim = compfunc(a, b, nan_policy=nan_policy) / 1
     abs_true = np.abs(true_sim)
 
+    # exceedances and (optionally) null comparisons are accumulated online as
+    # chunks are scored, so only one chunk of null maps is held at a time
     permutations = np.ones(true_sim.shape)
-    nulldist = np.zeros(((n_perm, ) + true_sim.shape))
-    for perm in range(n_perm):
-        # permute `a` and determine whether correlations exceed original
-        ap = a[rs.permutation(len(a))] if nulls is None else nulls[:, perm]
-        nullcomp = compfunc(ap, b, nan_policy=nan_policy)
-        permutations += np.abs(nullcomp) >= abs_true
-        nulldist[perm] = nullcomp
+    nulldist, n_seen = [], 0
+    chunk_size = None
+    if not streamed:
+        n_obs = a.size if nulls is None else np.prod(nulls.shape[:-1])
+        itemsize = a.itemsize if nulls is None else nulls.itemsize
+        if dtype is not None:
+            itemsize = max(itemsize, np.dtype(dtype).itemsize)
+        chunk_size = _get_chunk_size(n_obs, n_perm, itemsize=itemsize,
+                                     max_memory=max_memory)
+    if n_exceed is not None:
+        # smaller chunks so we don't generate too many unnecessary nulls
+        if chunk_size is not None:
+            chunk_size = min(chunk_size, 10 * n_exceed)
+        n_used = np.zeros(true_sim.shape, dtype=int)
+        stopped = np.zeros(true_sim.shape, dtype=bool)
+    # only arbitrary callables are worth distributing across processes
+    n_jobs = 1 if metric in methods else effective_n_jobs(n_proc)
+    if n_jobs > 1 and chunk_size is not None:
+        chunk_size = min(chunk_size, int(np.ceil(n_perm / n_jobs)))
+    chunks = _null_chunks(a, nulls, n_perm, rs, chunk_size, mask=null_mask,
+                          dtype=dtype)
+    score = partial(_score_chunk, b=b, compfunc=compfunc, batched=batched,
+                    nan_policy=nan_policy, rank=rank_nulls)
+    for start, nullcomp in _score_chunks(chunks, score, n_jobs=n_jobs):
+        # determine whether null comparisons exceed original
+        exceed = np.abs(nullcomp) >= abs_true
+        n_seen = start + len(nullcomp)
+        if return_nulls:
+            nulldist.append(nullcomp)
 
-    pvals = permutations / (n_perm + 1)  # + 1 in denom accounts for true_sim
+        if n_exceed is not None:
+            # find the null map at which `n_exceed` exceedances were reached
+            count = np.cumsum(exceed, axis=0) + (permutations - 1)
+            done = np.logical_and(np.logical_not(stopped),
+                                  count[-1] >= n_exceed)
+            first = np.argmax(count >= n_exceed, axis=0)
+            n_used[done] = start + first[done] + 1
+            stopped = np.logical_or(stopped, done)
+        permutations += np.sum(exceed, axis=0)
+        if n_exceed is not None and np.all(stopped):
+            break
+
+    pvals = permutations / (n_seen + 1)  # + 1 in denom accounts for true_sim
+    if n_exceed is not None:
+        n_used[np.logical_not(stopped)] = n_seen
+        pvals = np.where(stopped, n_exceed / np.maximum(n_used, 1), pvals)
+    # a nan similarity is never significant (no null can be more extreme)
+    pvals = np.where(np.isnan(true_sim), np.nan, pvals) / 1
+
+    if return_nulls:
+        nulldist = np.concatenate(
+            [np.reshape(d, (-1,) + true_sim.shape) for d in nulldist]
+            or [np.zeros((0,) + true_sim.shape, dtype=true_sim.dtype)]
+        )
+
+    if n_exceed is not None:
+        if return_nulls:
+            nulldist = nulldist[:np.max(n_used)]
+        out = (true_sim, pvals)
+        if return_nulls:
+            out += (nulldist,)
+        return out + (n_used[()],)
 
     if return_nulls:
         return true_sim, pvals, nulldist
@@ -204,6 +560,567 @@ def permtest_metric(a, b, metric='pearsonr', n_perm=1000, seed=0, nulls=None,
     return true_sim, pvals
 
 
+def batched_metric(metric):
+    """
+    Mark callable `metric` as able to compare many null maps at once.
+
+    Batched metrics are called with an (N, P) array of maps as their first
+    input and an (N,) array as their second input, and must return P values
+    (the similarity of every column in the first input with the second input).
+    When used with :func:`permtest_metric` or :func:`compare_images` they are
+    called once per chunk of null maps instead of once per null map.
+
+    Parameters
+    ----------
+    metric : callable
+        Similarity metric accepting batched inputs
+
+    Returns
+    -------
+    metric : callable
+        Wrapper of input `metric`, marked as batched
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from neuromaps import stats
+    >>> @stats.batched_metric
+    ... def covariance(x, y):
+    ...     x, y = x - x.mean(axis=0), y - y.mean()
+    ...     return (y @ x) / (len(y) - 1)
+    >>> x = np.arange(5.0)
+    >>> covariance(np.column_stack([x, -x]), x)
+    array([ 2.5, -2.5])
+    """
+    @wraps(metric)
+    def wrapper(*args, **kwargs):
+        return metric(*args, **kwargs)
+
+    wrapper.batched = True
+    return wrapper
+
+
+def _check_metric(metric):
+    """
+    Check that `metric` is a valid similarity metric.
+
+    Parameters
+    ----------
+    metric : {'pearsonr', 'spearmanr', callable}
+        Similarity metric
+
+    Raises
+    ------
+    ValueError
+        If `metric` is not valid
+    """
+    if metric not in ('pearsonr', 'spearmanr'):
+        if not callable(metric):
+            raise ValueError(f'Invalid `metric`: {metric}')
+        elif getattr(metric, 'batched', False):
+            if np.size(metric(np.ones((2, 1)), np.ones(2))) != 1:
+                raise ValueError('Provided batched `metric` must accept an '
+                                 '(N, P) and an (N,) input and return P '
+                                 'values.')
+        else:
+            if not np.isscalar(metric([1, 1], [1, 1])):
+                raise ValueError('Provided callable `metric` must accept two '
+                                 'inputs and return single value.')
+
+
+def _load_maps(imgs, dtype='float64'):
+    """
+    Load `imgs` into a two-dimensional array with one column per map.
+
+    Parameters
+    ----------
+    imgs : list or array_like
+        List of images accepted by :func:`~.images.load_data` or an (N, K)
+        array where each column is a map
+    dtype : {'float64', 'float32'}, optional
+        Floating point type of loaded maps. Default: 'float64'
+
+    Returns
+    -------
+    data : (N, K) numpy.ndarray
+        Loaded maps
+    """
+    if isinstance(imgs, np.ndarray):
+        return imgs.reshape(len(imgs), -1).astype(dtype)
+    return np.column_stack([np.ravel(load_data(img, dtype=dtype))
+                            for img in imgs])
+
+
+def _get_map_mask(data, ignore_zero=True, nan_policy='omit'):
+    """
+    Get mask of the observations in `data` that should be compared.
+
+    Parameters
+    ----------
+    data : (N, K) numpy.ndarray
+        Input maps
+    ignore_zero : bool, optional
+        Whether to mask zero values. Default: True
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Whether nan values are masked ('omit'), kept ('propagate'), or raise
+        an error ('raise'). Default: 'omit'
+
+    Returns
+    -------
+    mask : (N, K) numpy.ndarray
+        Boolean mask where True indicates observations to be compared
+    """
+    nanmask = np.isnan(data)
+    if nan_policy == 'raise' and np.any(nanmask):
+        raise ValueError('Inputs contain nan')
+
+    mask = np.ones(data.shape, dtype=bool)
+    if ignore_zero:
+        mask[np.isclose(data, 0)] = False
+    if nan_policy == 'omit':
+        mask[nanmask] = False
+
+    return mask
+
+
+def _rankdata_cols(x):
+    """
+    Rank every column of `x`, assigning tied values their average rank.
+
+    Vectorized equivalent of calling :func:`scipy.stats.rankdata` on every
+    column of `x`, except that nan values are ignored (ranks are assigned
+    among the non-nan values in each column) and remain nan in the output.
+    Floating point inputs keep their type; all other inputs are ranked as
+    float64.
+
+    Parameters
+    ----------
+    x : (N,) or (N, P) array_like
+        Input data
+
+    Returns
+    -------
+    ranks : numpy.ndarray
+        Ranked data, with the same shape as `x`
+    """
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(float)
+    shape, x = x.shape, x.reshape(len(x), -1)
+    n_obs = len(x)
+
+    # nan values are sorted to the end of each column
+    order = np.argsort(x, axis=0, kind='mergesort')
+    xsort = np.take_along_axis(x, order, axis=0)
+
+    # find the first and last (sorted) position of each group of tied values
+    start = np.ones(x.shape, dtype=bool)
+    start[1:] = xsort[1:] != xsort[:-1]
+    stop = np.ones(x.shape, dtype=bool)
+    stop[:-1] = start[1:]
+    idx = np.arange(n_obs)[:, None]
+    first = np.maximum.accumulate(np.where(start, idx, 0), axis=0)
+    last = np.minimum.accumulate(np.where(stop, idx, n_obs)[::-1], axis=0)
+
+    ranks = np.empty(x.shape, dtype=x.dtype)
+    np.put_along_axis(ranks, order, (first + last[::-1]) / 2 + 1, axis=0)
+    ranks[np.isnan(x)] = np.nan
+
+    return ranks.reshape(shape)
+
+
+def _pairwise_pearsonr(x, xmask, y, ymask, nan_policy='omit'):
+    """
+    Compute correlations between all columns of `x` and `y`.
+
+    Correlations between every pair of columns are computed using only
+    observations included in both of their masks, such that the result is
+    identical to correlating every pair separately.
+
+    Parameters
+    ----------
+    x : (N, K) array_like
+        Sample observations
+    xmask : (N, K) array_like
+        Boolean mask indicating which entries of `x` can be used
+    y : (N, M) array_like
+        Sample observations
+    ymask : (N, M) array_like
+        Boolean mask indicating which entries of `y` can be used
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Defines how to handle nan values inside the masks. 'propagate' returns
+        nan, 'raise' throws an error, 'omit' performs the calculations ignoring
+        nan values. Default: 'omit'
+
+    Returns
+    -------
+    corr : (K, M) numpy.ndarray
+        Pearson's correlation coefficients between columns of `x` and `y`
+    """
+    xnan = np.logical_and(np.isnan(x), xmask)
+    ynan = np.logical_and(np.isnan(y), ymask)
+    if nan_policy == 'raise' and (np.any(xnan) or np.any(ynan)):
+        raise ValueError('Input contains nan')
+
+    moments = []
+    for data, mask, nans in ((x, xmask, xnan), (y, ymask, ynan)):
+        valid = np.logical_and(mask, np.logical_not(nans))
+        # center each column (on its valid entries) for numerical stability;
+        # correlations are invariant to the shift so this does not need to
+        # use the pairwise mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            center = (np.sum(data, axis=0, where=valid, dtype=np.float64)
+                      / np.sum(valid, axis=0))
+        center = np.nan_to_num(center).astype(data.dtype)
+        data = np.where(valid, data - center, 0).astype(data.dtype,
+                                                        copy=False)
+        moments.append((data, valid.astype(data.dtype)))
+    (x, xvalid), (y, yvalid) = moments
+
+    n_obs = xvalid.T @ yvalid
+    xsum, ysum = x.T @ yvalid, xvalid.T @ y
+    xss, yss = (x ** 2).T @ yvalid, xvalid.T @ (y ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = (x.T @ y) - (xsum * ysum / n_obs)
+        var = ((xss - xsum ** 2 / n_obs) * (yss - ysum ** 2 / n_obs))
+        corr = np.clip(cov / np.sqrt(var), -1, 1)
+    if nan_policy == 'omit':
+        # pairs without variance are uncorrelated (see `efficient_pearsonr`)
+        corr = np.where(np.isnan(corr), 0, corr)
+
+    # nan values inside the shared mask of a pair propagate to the result
+    if nan_policy == 'propagate' and (np.any(xnan) or np.any(ynan)):
+        xmask, ymask = np.asarray(xmask, float), np.asarray(ymask, float)
+        nans = (xnan.astype(float).T @ ymask) + (xmask.T @ ynan.astype(float))
+        corr[nans > 0] = np.nan
+
+    return corr
+
+
+def _load_nulls(nulls):
+    """
+    Load `nulls` without reading them into memory, if possible.
+
+    Parameters
+    ----------
+    nulls : array_like or str or os.PathLike or iterator
+        Null maps, filepath to `.npy` file containing null maps, or iterator
+        yielding chunks of null maps
+
+    Returns
+    -------
+    nulls : (N, P) numpy.ndarray or numpy.memmap or iterator
+        Loaded null maps (iterators are returned as-is)
+    """
+    if isinstance(nulls, (str, os.PathLike)):
+        return np.load(nulls, mmap_mode='r', allow_pickle=False)
+    if not isinstance(nulls, (np.ndarray, Iterator)):
+        nulls = np.asarray(nulls)
+    return nulls
+
+
+def _get_chunk_size(n_obs, n_perm, itemsize=8, max_memory=None):
+    """
+    Determine how many null maps should be scored at once.
+
+    Parameters
+    ----------
+    n_obs : int
+        Number of observations in each null map
+    n_perm : int
+        Total number of null maps
+    itemsize : int, optional
+        Size (in bytes) of a single observation. Default: 8
+    max_memory : int, optional
+        Approximate upper bound on the size (in bytes) of each chunk. Default:
+        None
+
+    Returns
+    -------
+    chunk_size : int
+        Number of null maps per chunk
+    """
+    if max_memory is None:
+        max_memory = _MAX_CHUNK_BYTES
+    chunk_size = max_memory // max(n_obs * itemsize, 1)
+    return int(max(1, min(n_perm, chunk_size)))
+
+
+def _null_chunks(a, nulls, n_perm, rs, chunk_size, mask=None, dtype=None):
+    """
+    Yield consecutive chunks of null maps.
+
+    Parameters
+    ----------
+    a : (N,) or (N, K) numpy.ndarray
+        Sample observations that will be shuffled if `nulls` is None
+    nulls : (N, P) array_like or iterator or None
+        Pre-computed null maps, or an iterator yielding chunks of null maps
+    n_perm : int
+        Number of null maps to generate
+    rs : np.random.RandomState
+        Random state used to shuffle `a` if `nulls` is None
+    chunk_size : int
+        Number of null maps per chunk
+    mask : array_like of bool, optional
+        Boolean mask applied to all but the last axis of each chunk of
+        `nulls`. Default: None
+    dtype : str or numpy.dtype, optional
+        Type to which each chunk of `nulls` is cast. If not specified chunks
+        keep their stored type. Default: None
+
+    Yields
+    ------
+    start : int
+        Index of the first null map in `chunk`
+    chunk : (N, C) or (N, K, C) numpy.ndarray
+        Null maps, stacked along the last axis
+    """
+    if isinstance(nulls, Iterator):
+        # chunks are provided by the iterator; `n_perm` and `chunk_size` are
+        # irrelevant
+        start, ndim = 0, 1 if mask is None else np.ndim(mask)
+        for chunk in nulls:
+            chunk = np.asarray(chunk, dtype=dtype)
+            if chunk.ndim == ndim:
+                chunk = chunk[..., None]
+            if mask is not None:
+                chunk = chunk[mask]
+            yield start, chunk
+            start += chunk.shape[-1]
+        return
+
+    for start in range(0, n_perm, chunk_size):
+        stop = min(start + chunk_size, n_perm)
+        if nulls is None:
+            chunk = np.stack([a[rs.permutation(len(a))]
+                              for _ in range(start, stop)], axis=-1)
+        else:
+            chunk = np.asarray(nulls[..., start:stop], dtype=dtype)
+            if mask is not None:
+                chunk = chunk[mask]
+        yield start, chunk
+
+
+def _score_chunk(chunk, b, compfunc, batched=False, nan_policy='propagate',
+                 rank=False):
+    """
+    Compare every null map in `chunk` with `b`.
+
+    Parameters
+    ----------
+    chunk : (N, C) or (N, K, C) numpy.ndarray
+        Null maps, stacked along the last axis
+    b : (N,) or (N, K) numpy.ndarray
+        Sample observations
+    compfunc : callable
+        Function used to compare null maps with `b`
+    batched : bool, optional
+        Whether `compfunc` accepts all of `chunk` at once. Default: False
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Defines how to handle when input contains nan. Default: 'propagate'
+    rank : bool, optional
+        Whether to rank null maps before comparing them. Default: False
+
+    Returns
+    -------
+    nullcomp : (C,) or (C, K) numpy.ndarray
+        Comparisons between null maps and `b`
+    """
+    if rank:
+        chunk = _rankdata_cols(chunk)
+    if batched:
+        return compfunc(chunk, b, nan_policy=nan_policy)
+    return np.stack([
+        compfunc(chunk[..., n], b, nan_policy=nan_policy)
+        for n in range(chunk.shape[-1])
+    ])
+
+
+def _score_chunks(chunks, score, n_jobs=1):
+    """
+    Yield scores for each of `chunks`, distributed across `n_jobs` processes.
+
+    Chunks are consumed `n_jobs` at a time and scores are always yielded in
+    the order of `chunks`, so results do not depend on `n_jobs`.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Yields (start, chunk) tuples of null maps
+    score : callable
+        Function accepting a chunk and returning its scores
+    n_jobs : int, optional
+        Number of processes to use. Default: 1
+
+    Yields
+    ------
+    start : int
+        Index of the first null map in the scored chunk
+    nullcomp : numpy.ndarray
+        Scores of the chunk
+    """
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while True:
+            batch = list(islice(chunks, n_jobs))
+            if len(batch) == 0:
+                return
+            if n_jobs == 1:
+                scores = [score(chunk) for _, chunk in batch]
+            else:
+                scores = parallel(delayed(score)(chunk) for _, chunk in batch)
+            yield from zip([start for start, _ in batch], scores)
+
+
+def _metric_chunk(x, b, metric, nan_policy='propagate'):
+    """
+    Compute batched `metric` between every column in `x` and `b`.
+
+    Parameters
+    ----------
+    x : (N,) or (N, C) array_like
+        Null maps (or a single map) to be compared with `b`
+    b : (N,) numpy.ndarray
+        Sample observations
+    metric : callable
+        Batched similarity metric (see :func:`batched_metric`)
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Defines how to handle when input contains nan. Default: 'propagate'
+
+    Returns
+    -------
+    sim : (C,) numpy.ndarray
+        Similarity between columns of `x` and `b`
+    """
+    x = np.reshape(x, (len(x), -1))
+    nanmask = np.logical_or(np.isnan(x), np.isnan(b)[:, None])
+    if nan_policy == 'raise' and np.any(nanmask):
+        raise ValueError('Input contains nan')
+    elif nan_policy != 'omit' or not np.any(nanmask):
+        return np.reshape(metric(x, b), -1)
+
+    # call `metric` once for every group of columns sharing the same nan mask
+    sim = np.empty(x.shape[-1])
+    patterns, groups = np.unique(nanmask, axis=1, return_inverse=True)
+    for n, pattern in enumerate(patterns.T):
+        keep, cols = np.logical_not(pattern), np.ravel(groups) == n
+        sim[cols] = np.reshape(metric(x[keep][:, cols], b[keep]), -1)
+
+    return sim
+
+
+def _pearsonr_chunk(x, b, bz, nan_policy='propagate'):
+    """
+    Compute correlation of every column in `x` with `b`.
+
+    Parameters
+    ----------
+    x : (N,) or (N, C) array_like
+        Null maps (or a single map) to be correlated with `b`
+    b : (N,) or (N, K) numpy.ndarray
+        Sample observations
+    bz : (N,) or (N, K) numpy.ndarray
+        Pre-computed z-scores of `b` (with `ddof=1`)
+    nan_policy : {'propagate', 'raise', 'omit'}, optional
+        Defines how to handle when input contains nan. Default: 'propagate'
+
+    Returns
+    -------
+    corr : (C,) or (C, K) numpy.ndarray
+        Pearson's correlation coefficients between columns of `x` and `b`
+    """
+    x = np.reshape(x, (len(x), -1)).astype(bz.dtype, copy=False)
+    xnan, bnan = np.any(np.isnan(x)), np.any(np.isnan(b))
+    if nan_policy == 'raise' and (xnan or bnan):
+        raise ValueError('Input contains nan')
+    elif nan_policy == 'omit' and (xnan or bnan):
+        # masks differ between columns so use the nan-aware version
+        if b.ndim == 1:
+            corr = efficient_pearsonr(x, b, nan_policy=nan_policy,
+                                      return_pval=False)
+            return np.atleast_1d(corr)
+        return np.stack([
+            efficient_pearsonr(col, b, nan_policy=nan_policy,
+                               return_pval=False)
+            for col in x.T
+        ])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xz = _zscore(x, ddof=1)
+    corr = (xz.T @ bz) / (len(x) - 1)
+    if nan_policy == 'omit':
+        # maps without variance are uncorrelated (see `efficient_pearsonr`)
+        corr = np.where(np.isnan(corr), 0, corr)
+
+    return np.clip(corr, -1, 1)
+
+
+def _zscore(x, ddof=1):
+    """
+    Z-score columns of `x`, accumulating moments in double precision.
+
+    Parameters
+    ----------
+    x : (N,) or (N, P) numpy.ndarray
+        Input data
+    ddof : int, optional
+        Degrees of freedom correction in the calculation of the standard
+        deviation. Default: 1
+
+    Returns
+    -------
+    z : numpy.ndarray
+        Z-scored `x`, with the same shape and (floating point) type as `x`
+    """
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(float)
+    mean = np.mean(x, axis=0, dtype=np.float64)
+    x = x - mean.astype(x.dtype)
+    std = np.sqrt(np.sum(x * x, axis=0, dtype=np.float64)
+                  / (len(x) - ddof))
+    return x / std.astype(x.dtype)
+
+
+def _nan_pearsonr(a, b, mask, ddof=1):
+    """
+    Compute correlation of matching columns in `a` and `b`, omitting `mask`.
+
+    Uses per-column counts, sums, and sums of squares of the unmasked entries
+    instead of masked arrays.
+
+    Parameters
+    ----------
+    a, b : (N, P) numpy.ndarray
+        Sample observations
+    mask : (N, P) numpy.ndarray
+        Boolean mask indicating entries of `a` and `b` that should be omitted
+    ddof : int, optional
+        Degrees of freedom correction in the calculation of the standard
+        deviation. Default: 1
+
+    Returns
+    -------
+    corr : (P,) numpy.ndarray
+        Pearson's correlation coefficient between matching columns of inputs
+    n_obs : (P,) numpy.ndarray
+        Number of observations used for each correlation
+    """
+    valid = np.logical_not(mask)
+    n_obs = np.squeeze(np.sum(valid, axis=0))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.where(valid, a, 0)
+        a = np.where(valid, a - np.sum(a, axis=0) / n_obs, 0)
+        b = np.where(valid, b, 0)
+        b = np.where(valid, b - np.sum(b, axis=0) / n_obs, 0)
+        corr = (np.sum(a * b, axis=0)
+                / np.sqrt(np.sum(a ** 2, axis=0) * np.sum(b ** 2, axis=0)))
+        # equivalent to the product of z-scores computed with `ddof`
+        corr *= (n_obs - ddof) / (n_obs - 1)
+
+    return corr, n_obs
+
+
 def efficient_pearsonr(a, b, ddof=1, nan_policy='propagate', return_pval=True):
     """
     Compute correlation of matching columns in `a` and `b`.
@@ -231,7 +1148,8 @@ def efficient_pearsonr(a, b, ddof=1, nan_policy='propagate', return_pval=True):
     Notes
     -----
     If either input contains nan and nan_policy is set to 'omit', both arrays
-    will be masked to omit the nan entries.
+    will be masked to omit the nan entries. In that case columns without any
+    variance have a correlation of zero (and a p-value of nan).
     """
     a, b, _ = _chk2_asarray(a, b, 0)
     if len(a) != len(b):
@@ -250,22 +1168,19 @@ def efficient_pearsonr(a, b, ddof=1, nan_policy='propagate', return_pval=True):
     mask = np.logical_or(np.isnan(a), np.isnan(b))
     if nan_policy == 'raise' and np.any(mask):
         raise ValueError('Input contains nan')
-    elif nan_policy == 'omit':
-        # avoid making copies of the data, if possible
-        a = np.ma.masked_array(a, mask, copy=False, fill_value=np.nan)
-        b = np.ma.masked_array(b, mask, copy=False, fill_value=np.nan)
-
-    with np.errstate(invalid='ignore'):
-        corr = (sstats.zscore(a, ddof=ddof, nan_policy=nan_policy)
-                * sstats.zscore(b, ddof=ddof, nan_policy=nan_policy))
+    elif nan_policy == 'omit' and np.any(mask):
+        corr, n_obs = _nan_pearsonr(a, b, mask, ddof=ddof)
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = _zscore(a, ddof=ddof) * _zscore(b, ddof=ddof)
+        n_obs = len(a)
+        corr = np.sum(corr, axis=0) / (n_obs - 1)
 
-    sumfunc, n_obs = np.sum, len(a)
     if nan_policy == 'omit':
-        corr = corr.filled(np.nan)
-        sumfunc = np.nansum
-        n_obs = np.squeeze(np.sum(np.logical_not(np.isnan(corr)), axis=0))
-
-    corr = sumfunc(corr, axis=0) / (n_obs - 1)
+        # columns without variance (or observations) are uncorrelated
+        degenerate = np.isnan(corr)
+        corr = np.where(degenerate, 0, corr)
+        n_obs = np.squeeze(np.where(degenerate, 0, n_obs))
     corr = np.squeeze(np.clip(corr, -1, 1)) / 1
 
     if return_pval:
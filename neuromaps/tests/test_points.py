@@ -3,6 +3,8 @@
 
 import numpy as np
 import pytest
+from scipy import ndimage, sparse
+from scipy.spatial import cKDTree
 
 from neuromaps import points
 
@@ -57,3 +59,166 @@ def test_make_surf_graph():
 def test_get_surface_distance():
     """Test getting surface distance."""
     assert False
+
+
+def test_sparsify_distance():
+    """Test sparsifying a distance matrix."""
+    rs = np.random.default_rng(1234)
+    coords = rs.random((50, 3))
+    dist = np.linalg.norm(coords[:, None] - coords, axis=-1)
+
+    knn = points.sparsify_distance(dist, n_neighbors=5, chunk_size=7)
+    assert knn.shape == dist.shape and knn.diagonal().sum() == 0
+    assert np.allclose((knn - knn.T).data, 0)
+    rows, cols = knn.nonzero()
+    assert np.allclose(knn[rows, cols], dist[rows, cols])
+    # every vertex keeps (at least) its nearest neighbours
+    nearest = np.argsort(dist, axis=1)[:, 1:6]
+    assert np.all(knn.toarray()[np.arange(50)[:, None], nearest] > 0)
+
+    cut = points.sparsify_distance(dist, cutoff=0.3)
+    expected = np.logical_and(dist <= 0.3, np.logical_not(np.eye(50)))
+    assert np.array_equal(cut.toarray() > 0, expected)
+
+    # sparse inputs are handled the same as dense inputs
+    assert np.allclose(points.sparsify_distance(cut, n_neighbors=5).toarray(),
+                       points.sparsify_distance(dist, n_neighbors=5,
+                                                cutoff=0.3).toarray())
+
+    with pytest.raises(ValueError):
+        points.sparsify_distance(dist)
+
+
+def test__get_graph_distance():
+    """Test getting surface distance of blocks of vertices."""
+    graph = sparse.random(60, 60, density=0.1, random_state=1234,
+                          format='csr')
+    expected = sparse.csgraph.dijkstra(graph, directed=False)
+    assert np.allclose(points._get_graph_distance(np.arange(60), graph,
+                                                  chunk_size=7), expected)
+
+    out = np.zeros((60, 60), dtype='float32')
+    points._get_graph_distance(np.arange(10, 60), graph, out)
+    assert np.allclose(out[10:], expected[10:]) and np.all(out[:10] == 0)
+
+
+def test__get_sparse_graph_distance():
+    """Test getting surface distance of vertices to their neighbours."""
+    graph = sparse.random(60, 60, density=0.1, random_state=1234,
+                          format='csr')
+    dist = sparse.csgraph.dijkstra(graph, directed=False)
+    expected = points.sparsify_distance(dist, n_neighbors=5)
+    row, col, val = points._get_sparse_graph_distance(np.arange(60), graph,
+                                                      n_neighbors=5,
+                                                      chunk_size=7)
+    out = points._sparse_neighbors(row, col, val, 60, n_neighbors=5)
+    assert np.allclose(out.toarray(), expected.toarray())
+
+
+@pytest.mark.parametrize('factor', [2, 0.1])
+def test__get_knn_graph_distance(factor):
+    """Test bounding shortest paths to nearest neighbours."""
+    rs = np.random.default_rng(1234)
+    coords = rs.random((60, 3))
+    tree = cKDTree(coords)
+    # edges weighted by Euclidean length, so paths are never shorter
+    dist, idx = tree.query(coords, k=4)
+    graph = sparse.csr_matrix((dist[:, 1:].ravel(),
+                               (np.repeat(np.arange(60), 3),
+                                idx[:, 1:].ravel())), shape=(60, 60))
+    full = sparse.csgraph.dijkstra(graph, directed=False)
+    out = points._get_knn_graph_distance(np.arange(60), graph, 5, tree,
+                                         factor=factor)
+    assert np.all(np.sum(np.isfinite(out), axis=1) >= 6)
+    assert np.allclose(np.sort(out, axis=1)[:, :6],
+                       np.sort(full, axis=1)[:, :6])
+
+    expected = points.sparsify_distance(full, n_neighbors=5)
+    row, col, val = points._get_sparse_graph_distance(np.arange(60), graph,
+                                                      n_neighbors=5,
+                                                      coords=coords,
+                                                      chunk_size=7)
+    out = points._sparse_neighbors(row, col, val, 60, n_neighbors=5)
+    assert np.allclose(out.toarray(), expected.toarray())
+
+
+def test__get_parcel_distance():
+    """Test getting summed parcel distances of blocks of vertices."""
+    rs = np.random.default_rng(1234)
+    graph = sparse.random(60, 60, density=0.1, random_state=1234,
+                          format='csr')
+    labels = rs.integers(4, size=60)
+    dist = sparse.csgraph.dijkstra(graph, directed=False)
+
+    # parcel averages exclude the source vertex itself
+    dist = np.vstack([
+        ndimage.mean(np.delete(row, n), np.delete(labels, n), range(4))
+        for n, row in enumerate(dist)
+    ])
+    expected = np.vstack([dist[labels == lab].sum(axis=0) for lab in range(4)])
+    out = sum(points._get_parcel_distance(block, graph, labels, chunk_size=7)
+              for block in np.array_split(np.arange(60), 3))
+    assert np.allclose(out, expected)
+
+
+def test__get_parcel_min_distance():
+    """Test getting minimum distance between parcels."""
+    rs = np.random.default_rng(1234)
+    graph = sparse.random(60, 60, density=0.1, random_state=1234,
+                          format='csr')
+    labels = rs.integers(4, size=60)
+    dist = sparse.csgraph.dijkstra(graph, directed=False)
+    expected = np.array([[dist[np.ix_(labels == i, labels == j)].min()
+                          for j in range(4)] for i in range(4)])
+    out = points._get_parcel_min_distance([1, 3], graph, labels)
+    assert np.allclose(out, expected[[1, 3]])
+
+
+def test__get_landmark_distance():
+    """Test approximating surface distances with landmarks."""
+    x, y = np.meshgrid(np.arange(20), np.arange(20))
+    vert = np.column_stack([x.ravel(), y.ravel(), np.zeros(400)])
+    corner = np.arange(19 * 20).reshape(19, 20)[:, :-1].ravel()
+    faces = np.vstack([np.column_stack([corner, corner + 1, corner + 20]),
+                       np.column_stack([corner + 1, corner + 21,
+                                        corner + 20])])
+    graph = points.make_surf_graph(vert, faces)
+    expected = sparse.csgraph.dijkstra(graph, directed=False)
+
+    landmarks = points._get_landmarks(vert, graph, 20, seed=1234)
+    assert len(np.unique(landmarks)) == 20
+    ldist = points._get_graph_distance(landmarks, graph)
+    out = points._get_landmark_distance(np.arange(400), graph, ldist, 5)
+    # distances are exact up to the limit and overestimated beyond it
+    short = expected <= 5
+    assert np.allclose(out[short], expected[short])
+    assert np.all(out >= expected - 1e-4)
+    assert np.mean((out - expected)[~short] / expected[~short]) < 0.05
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_condensed_distance(tmp_path, dtype):
+    """Test storing distance matrices as blocks of their upper triangle."""
+    rs = np.random.default_rng(1234)
+    coords = rs.random((100, 3))
+    dist = np.linalg.norm(coords[:, None] - coords, axis=-1)
+
+    cdist = points.CondensedDistance.create(tmp_path / 'dist', dist, 100,
+                                            dtype=dtype, block_size=16,
+                                            n_neighbors=10)
+    atol = 1e-6 if dtype == 'float32' else 1e-3
+    assert cdist.shape == (100, 100)
+    assert np.allclose(cdist.toarray(), dist, atol=atol)
+    assert np.allclose(cdist[[3, 97, 40]], dist[[3, 97, 40]], atol=atol)
+    assert np.allclose(cdist[20:50], dist[20:50], atol=atol)
+    assert cdist.n_blocks == 7
+    assert np.allclose(cdist.block(6), dist[96:], atol=atol)
+    assert np.allclose(np.vstack([cdist.block(n) for n in range(7)]), dist,
+                       atol=atol)
+
+    knn_dist, knn_index = points.CondensedDistance(tmp_path / 'dist').knn(5)
+    assert np.all(knn_index[:, 0] == np.arange(100))
+    assert np.allclose(knn_dist, np.sort(dist, axis=1)[:, :6])
+    assert np.allclose(np.take_along_axis(dist, knn_index, axis=1), knn_dist)
+    with pytest.raises(ValueError):
+        cdist.knn(20)
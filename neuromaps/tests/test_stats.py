@@ -3,6 +3,7 @@
 
 import numpy as np
 import pytest
+from scipy import stats as sstats
 
 from neuromaps import stats
 
@@ -13,6 +14,92 @@ def test_compare_images():
     assert False
 
 
+def test_compare_images_chunked(tmp_path):
+    """Test comparing images with memory-mapped nulls read in chunks."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    x[:10] = 0
+    nulls = rs.random(size=(100, 50))
+    fn = tmp_path / 'nulls.npy'
+    np.save(fn, nulls)
+
+    expected = stats.compare_images(x, y, nulls=nulls, return_nulls=True)
+    out = stats.compare_images(x, y, nulls=fn, return_nulls=True,
+                               max_memory=1000)
+    for exp, res in zip(expected, out):
+        assert np.allclose(exp, res)
+
+
+@pytest.mark.parametrize('metric', ['pearsonr', 'spearmanr'])
+def test_compare_images_matrix(metric):
+    """Test comparing many images at once."""
+    rs = np.random.default_rng(12345678)
+    src, trg = rs.random(size=(100, 2)), rs.random(size=(100, 3))
+    src[:10, 0], trg[20:30, 1] = 0, np.nan
+    nulls = [rs.random(size=(100, 25)) for _ in range(2)]
+
+    sim, pval = stats.compare_images_matrix(src, trg, metric=metric,
+                                            nulls=nulls)
+    assert sim.shape == pval.shape == (2, 3)
+    for k in range(2):
+        for m in range(3):
+            r, p = stats.compare_images(src[:, k], trg[:, m], metric=metric,
+                                        nulls=nulls[k])
+            assert np.isclose(sim[k, m], r) and np.isclose(pval[k, m], p)
+
+
+def test_compare_images_matrix_callable():
+    """Test comparing many images at once with a callable metric."""
+
+    def corr(x, y):
+        return np.corrcoef(x, y)[0, 1]
+
+    rs = np.random.default_rng(12345678)
+    src, trg = rs.random(size=(100, 2)), rs.random(size=(100, 3))
+    src[:10, 0], trg[20:30, 1] = 0, np.nan
+    nulls = [rs.random(size=(100, 25)) for _ in range(2)]
+
+    sim, pval, dist = stats.compare_images_matrix(src, trg, metric=corr,
+                                                  nulls=nulls,
+                                                  return_nulls=True,
+                                                  max_memory=8000)
+    assert dist.shape == (2, 3, 25)
+    for k in range(2):
+        for m in range(3):
+            r, p, d = stats.compare_images(src[:, k], trg[:, m], metric=corr,
+                                           nulls=nulls[k], return_nulls=True)
+            assert np.isclose(sim[k, m], r) and np.isclose(pval[k, m], p)
+            assert np.allclose(dist[k, m], d)
+
+
+def test_compare_images_iterator():
+    """Test comparing images with nulls provided by an iterator."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    x[:10] = 0
+    nulls = rs.random(size=(100, 50))
+
+    expected = stats.compare_images(x, y, nulls=nulls, return_nulls=True)
+    single = stats.compare_images(x, y, nulls=iter(nulls.T),
+                                  return_nulls=True)
+    chunks = stats.compare_images(x, y, return_nulls=True,
+                                  nulls=(nulls[:, n:n + 20]
+                                         for n in range(0, 50, 20)))
+    for exp, res1, res2 in zip(expected, single, chunks):
+        assert np.allclose(exp, res1) and np.allclose(exp, res2)
+
+    # iterator is not consumed past the stopping point
+    consumed = []
+
+    def gen():
+        for null in nulls.T:
+            consumed.append(null)
+            yield null
+
+    *_, n_used = stats.compare_images(x, y, nulls=gen(), n_exceed=1)
+    assert len(consumed) == n_used
+
+
 def test_permtest_metric():
     """Test permutation testing of a metric."""
     rs = np.random.default_rng(12345678)
@@ -25,6 +112,127 @@ def test_permtest_metric():
     assert np.allclose(p, [0.7192807192807192, 0.7472527472527473])
 
 
+def test_permtest_metric_nulls():
+    """Test permutation testing with pre-computed nulls."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    nulls = rs.random(size=(100, 250))
+    r, p, dist = stats.permtest_metric(x, y, nulls=nulls, return_nulls=True)
+    expected = [stats.efficient_pearsonr(n, y)[0] for n in nulls.T]
+    assert np.allclose(dist, expected)
+    assert np.isclose(p, (np.sum(np.abs(dist) >= np.abs(r)) + 1) / 251)
+
+
+def test_permtest_metric_spearmanr_nulls():
+    """Test that null maps are ranked for Spearman permutation tests."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    nulls = rs.random(size=(100, 50)) ** 3
+    out = stats.permtest_metric(x, y, metric='spearmanr', nulls=nulls,
+                                return_nulls=True)
+    ranked = np.column_stack([sstats.rankdata(n) for n in nulls.T])
+    expected = stats.permtest_metric(sstats.rankdata(x), sstats.rankdata(y),
+                                     nulls=ranked, return_nulls=True)
+    for exp, res in zip(expected, out):
+        assert np.allclose(exp, res)
+
+
+def test_permtest_metric_sequential():
+    """Test sequential permutation testing with early stopping."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    r, p, nulls, n_used = stats.permtest_metric(x, y, n_perm=5000,
+                                                n_exceed=10,
+                                                return_nulls=True)
+    assert n_used < 5000 and len(nulls) == n_used
+    assert np.sum(np.abs(nulls) >= np.abs(r)) == 10
+    assert np.isclose(p, 10 / n_used)
+
+    # the first `n_used` nulls are identical to a full run
+    _, _, full = stats.permtest_metric(x, y, n_perm=5000, return_nulls=True)
+    assert np.allclose(full[:n_used], nulls)
+
+
+def test_permtest_metric_nan():
+    """Test that nan similarities are not reported as significant."""
+    rs = np.random.default_rng(12345678)
+    y = rs.random(size=100)
+    nulls = rs.random(size=(100, 50))
+    r, p = stats.permtest_metric(np.ones(100), y, nulls=nulls)
+    assert np.isnan(r) and np.isnan(p)
+    r, p, n_used = stats.permtest_metric(np.ones(100), y, n_perm=50,
+                                         n_exceed=5)
+    assert np.isnan(r) and np.isnan(p) and n_used == 50
+
+    # binary map that is constant once zeros are ignored
+    x = (rs.random(size=100) > 0.5).astype(float)
+    r, p = stats.compare_images(x, y, nulls=nulls, nan_policy='propagate')
+    assert np.isnan(r) and np.isnan(p)
+
+
+def test_permtest_metric_batched():
+    """Test permutation testing with a batched callable metric."""
+
+    def corr(x, y):
+        return np.corrcoef(x, y)[0, 1]
+
+    @stats.batched_metric
+    def batch_corr(x, y):
+        x = (x - x.mean(axis=0)) / x.std(axis=0)
+        return ((y - y.mean()) / y.std()) @ x / len(y)
+
+    # the decorated callable itself is left untouched
+    assert batch_corr.batched and not hasattr(batch_corr.__wrapped__,
+                                              'batched')
+    assert stats.batched_metric(np.dot).batched
+    assert not hasattr(np.dot, 'batched')
+
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    nulls = rs.random(size=(100, 50))
+    nulls[:5, :10] = np.nan
+    for nan_policy in ('omit', 'propagate'):
+        expected = stats.permtest_metric(x, y, corr, nulls=nulls,
+                                         nan_policy=nan_policy,
+                                         return_nulls=True)
+        out = stats.permtest_metric(x, y, batch_corr, nulls=nulls,
+                                    nan_policy=nan_policy, return_nulls=True)
+        for exp, res in zip(expected, out):
+            assert np.allclose(exp, res, equal_nan=True)
+
+
+def test_permtest_metric_n_proc():
+    """Test that parallel permutation testing is deterministic."""
+
+    def corr(x, y):
+        return np.corrcoef(x, y)[0, 1]
+
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100))
+    expected = stats.permtest_metric(x, y, corr, n_perm=100,
+                                     return_nulls=True)
+    out = stats.permtest_metric(x, y, corr, n_perm=100, return_nulls=True,
+                                n_proc=2)
+    for exp, res in zip(expected, out):
+        assert np.allclose(exp, res)
+
+
+@pytest.mark.parametrize('metric', ['pearsonr', 'spearmanr'])
+def test_permtest_metric_float32(metric):
+    """Test permutation testing in single precision."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 1000))
+    nulls = rs.random(size=(1000, 50), dtype='float32')
+    expected = stats.permtest_metric(x, y, metric, nulls=nulls,
+                                     return_nulls=True)
+    out = stats.permtest_metric(x, y, metric, nulls=nulls,
+                                return_nulls=True, dtype='float32')
+    assert out[2].dtype == np.float32
+    assert np.allclose(expected[0], out[0], atol=1e-6)
+    assert np.allclose(expected[1], out[1])
+    assert np.allclose(expected[2], out[2], atol=1e-6)
+
+
 @pytest.mark.parametrize('x, y, expected', [
     # basic one-dimensional input
     (range(5), range(5), (1.0, 0.0)),
@@ -43,6 +251,37 @@ def test_efficient_pearsonr(x, y, expected):
     assert np.allclose(stats.efficient_pearsonr(x, y), expected)
 
 
+def test_efficient_pearsonr_omit():
+    """Test efficient Pearson correlation omitting nan values."""
+    rs = np.random.default_rng(12345678)
+    x, y = rs.random(size=(2, 100, 5))
+    x[rs.random(size=x.shape) < 0.1] = np.nan
+    y[rs.random(size=y.shape) < 0.1] = np.nan
+    corr, pval = stats.efficient_pearsonr(x, y, nan_policy='omit')
+    for n in range(5):
+        mask = np.logical_not(np.isnan(x[:, n]) | np.isnan(y[:, n]))
+        r, p = sstats.pearsonr(x[mask, n], y[mask, n])
+        assert np.isclose(corr[n], r) and np.isclose(pval[n], p)
+
+
+def test_efficient_pearsonr_constant():
+    """Test efficient Pearson correlation of maps without variance."""
+    x = np.column_stack([np.ones(10), np.arange(10) ** 2])
+    corr, pval = stats.efficient_pearsonr(x, np.arange(10), nan_policy='omit')
+    assert corr[0] == 0 and np.isnan(pval[0])
+    assert np.isclose(corr[1], sstats.pearsonr(x[:, 1], np.arange(10))[0])
+    assert np.isnan(stats.efficient_pearsonr(x, np.arange(10))[0][0])
+
+    # binary map that is constant once zeros are ignored
+    rs = np.random.default_rng(12345678)
+    x = (rs.random(size=100) > 0.5).astype(float)
+    y, nulls = rs.random(size=100), rs.random(size=(100, 50))
+    assert np.allclose(stats.compare_images(x, y, nulls=nulls), (0, 1))
+    sim, pval = stats.compare_images_matrix(np.column_stack([x, y]),
+                                            nulls=[nulls, nulls])
+    assert np.allclose(sim[0], 0) and np.allclose(pval[0], 1)
+
+
 def test_efficient_pearsonr_errors():
     """Test efficient Pearson correlation errors."""
     with pytest.raises(ValueError):
@@ -2,6 +2,7 @@
 """For testing neuromaps.utils functionality."""
 
 import os
+
 import pytest
 
 from neuromaps import utils
@@ -14,6 +15,14 @@ def test_tmpname(tmp_path):
             and out.name.endswith('.nii.gz'))
 
 
+def test__split_n_proc():
+    """Test splitting processors between tasks."""
+    assert utils._split_n_proc(1, 2) == (1, 1)
+    assert utils._split_n_proc(8, 2) == (2, 4)
+    assert utils._split_n_proc(3, 2) == (2, 1)
+    assert utils._split_n_proc(4, 1) == (1, 4)
+
+
 @pytest.mark.xfail
 def test_run():
     """Test running a command."""
@@ -6,6 +6,8 @@ from pathlib import Path
 import tempfile
 import subprocess
 
+from joblib import effective_n_jobs
+
 
 def tmpname(suffix, prefix=None, directory=None):
     """
@@ -125,3 +127,31 @@ def check_fs_subjid(subject_id, subjects_dir=None):
                                 .format(subject_id, subjects_dir))
 
     return subject_id, subjects_dir
+
+
+def _split_n_proc(n_proc, n_tasks):
+    """
+    Split `n_proc` processors between `n_tasks` independent tasks.
+
+    Up to `n_proc` tasks are run concurrently and the available processors are
+    divided evenly between them (e.g., with `n_proc=8` two hemispheres are
+    processed at the same time using four processors each).
+
+    Parameters
+    ----------
+    n_proc : int
+        Number of processors to use. If negative will use max available
+        processors plus 1 minus the specified number
+    n_tasks : int
+        Number of independent tasks
+
+    Returns
+    -------
+    n_outer : int
+        Number of tasks to run concurrently
+    n_inner : int
+        Number of processors available to each task
+    """
+    n_jobs = effective_n_jobs(n_proc)
+    n_outer = max(1, min(n_jobs, n_tasks))
+    return n_outer, max(1, n_jobs // n_outer)